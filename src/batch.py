@@ -0,0 +1,148 @@
+"""JSONLファイルのプロンプトを非対話で処理するバッチランナー
+
+入力（1行1リクエスト）:
+    {"id": "q1", "input": "東京の天気を教えて", "conversation": "c1"}
+
+conversationが同じリクエストは入力順に同じ履歴で処理し、異なる会話は並行して処理する。
+conversationを省略したリクエストはそれぞれ独立した会話として扱う。
+
+出力（1行1結果、完了順）:
+    {"id": "q1", "conversation": "c1", "input": "...", "output": "...", "error": false,
+     "latency_ms": 1234.5, "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}}
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import get_usage_metadata_callback
+
+from code_interpreter_pool import set_session_key
+from main import ERROR_PREFIX, LangChainCLIAgent
+
+
+def load_requests(path: str) -> "OrderedDict[str, List[dict]]":
+    """入力JSONLを読み込み、会話ごとにまとめる"""
+    conversations: "OrderedDict[str, List[dict]]" = OrderedDict()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: JSONとして読み込めません: {e}") from e
+            if not isinstance(request, dict) or not isinstance(request.get("input"), str):
+                raise ValueError(f"{path}:{line_no}: \"input\" が必要です")
+            request.setdefault("id", str(line_no))
+            conversation = str(request.get("conversation") or f"_line{line_no}")
+            conversations.setdefault(conversation, []).append(request)
+    return conversations
+
+
+def _sum_usage(usage_by_model: Dict[str, dict]) -> Dict[str, int]:
+    total = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    for usage in usage_by_model.values():
+        for key in total:
+            total[key] += usage.get(key, 0)
+    return total
+
+
+class BatchRunner:
+    """会話単位で並行してプロンプトを処理する
+
+    Args:
+        agent: 使用するエージェント（全会話で共有）
+        concurrency: 同時に処理する会話数の上限
+    """
+
+    def __init__(self, agent: LangChainCLIAgent, concurrency: int = 4):
+        self.agent = agent
+        self.concurrency = concurrency
+        self._write_lock = threading.Lock()
+
+    def run(self, conversations: "OrderedDict[str, List[dict]]", out) -> List[dict]:
+        """全会話を処理し、結果を out に1行ずつ書き出す"""
+        results: List[dict] = []
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix="batch") as executor:
+            futures = [
+                executor.submit(self._run_conversation, name, requests, out, results)
+                for name, requests in conversations.items()
+            ]
+            for future in futures:
+                future.result()
+        return results
+
+    def _run_conversation(self, name: str, requests: List[dict], out, results: List[dict]):
+        # 会話ごとに履歴とCode Interpreterのサンドボックスを分ける
+        set_session_key(f"batch-{name}")
+        history = self.agent.create_history()
+        for request in requests:
+            started = time.perf_counter()
+            with get_usage_metadata_callback() as usage:
+                output = self.agent.chat(request["input"], history=history)
+            result = {
+                "id": request["id"],
+                "conversation": request.get("conversation"),
+                "input": request["input"],
+                "output": output,
+                "error": output.startswith(ERROR_PREFIX),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "usage": _sum_usage(usage.usage_metadata),
+            }
+            with self._write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                results.append(result)
+
+
+def summarize(results: List[dict], elapsed: float) -> str:
+    """処理結果の集計を文字列にする"""
+    if not results:
+        return "処理したリクエストはありません。"
+    latencies = sorted(r["latency_ms"] for r in results)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    tokens = sum(r["usage"]["total_tokens"] for r in results)
+    errors = sum(1 for r in results if r["error"])
+    return (f"📊 {len(results)}件処理（エラー {errors}件） / 所要時間 {elapsed:.1f}秒 / "
+            f"{len(results) / elapsed:.2f}件/秒\n"
+            f"   レイテンシ p50 {statistics.median(latencies):.0f}ms / p95 {p95:.0f}ms / "
+            f"トークン合計 {tokens}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """バッチ処理のエントリーポイント"""
+    parser = argparse.ArgumentParser(description="JSONLのプロンプトをエージェントで一括処理")
+    parser.add_argument("input", help="入力JSONLファイル")
+    parser.add_argument("-o", "--output", default="-", help="出力JSONLファイル（デフォルト: 標準出力）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同時に処理する会話数")
+    args = parser.parse_args(argv)
+
+    try:
+        conversations = load_requests(args.input)
+    except (OSError, ValueError) as e:
+        print(f"❌ 入力を読み込めませんでした: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    agent = LangChainCLIAgent(streaming=False)
+    # 並行実行で詳細ログが混ざらないようにする
+    agent.agent_executor.verbose = False
+    runner = BatchRunner(agent, concurrency=args.concurrency)
+
+    started = time.perf_counter()
+    if args.output == "-":
+        results = runner.run(conversations, sys.stdout)
+    else:
+        with open(args.output, "w", encoding="utf-8") as out:
+            results = runner.run(conversations, out)
+    print(summarize(results, time.perf_counter() - started), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
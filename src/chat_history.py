@@ -0,0 +1,171 @@
+"""トークン予算付きのチャット履歴管理
+
+履歴の推定トークン数が予算を超えた場合、古いターンから順に
+削除・切り詰め・要約のいずれかで圧縮してから送信する。
+"""
+import asyncio
+from typing import Callable, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+COMPACTION_STRATEGIES = ("drop", "truncate", "summarize")
+
+SUMMARY_PREFIX = "[これまでの会話の要約]"
+SUMMARY_ACK = "承知しました。この要約を前提に会話を続けます。"
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する（ASCIIは約4文字、それ以外は約1文字で1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+    )
+
+
+def make_llm_summarizer(llm, max_chars: int = 1200) -> Callable[[List[BaseMessage]], str]:
+    """LLMで会話を要約する関数を作成
+
+    Args:
+        llm: 要約に使うチャットモデル
+        max_chars: 要約の目安の最大文字数
+    """
+    def summarize(messages: List[BaseMessage]) -> str:
+        transcript = "\n".join(
+            f"{'ユーザー' if m.type == 'human' else 'アシスタント'}: {_message_text(m)}"
+            for m in messages
+        )
+        response = llm.invoke([HumanMessage(content=(
+            f"以下の会話を、後続の会話に必要な事実・決定事項・数値を残して"
+            f"{max_chars}文字以内で要約してください。\n\n{transcript}"
+        ))])
+        return _message_text(response).strip()
+    return summarize
+
+
+class ChatHistoryManager:
+    """トークン予算を超えないように圧縮されるチャット履歴
+
+    Args:
+        max_tokens: 履歴全体の推定トークン数の上限
+        strategy: 圧縮方法（"drop" / "truncate" / "summarize"）
+        keep_recent_turns: 圧縮対象から外す直近のターン数
+        summarizer: strategy="summarize" で使う要約関数
+        truncate_chars: strategy="truncate" で古いメッセージを切り詰める文字数
+        token_counter: テキストのトークン数を数える関数
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 8000,
+        strategy: str = "drop",
+        keep_recent_turns: int = 2,
+        summarizer: Optional[Callable[[List[BaseMessage]], str]] = None,
+        truncate_chars: int = 500,
+        token_counter: Callable[[str], int] = estimate_tokens,
+    ):
+        if strategy not in COMPACTION_STRATEGIES:
+            raise ValueError(f"不明な圧縮方法です: {strategy}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.keep_recent_turns = keep_recent_turns
+        self.summarizer = summarizer
+        self.truncate_chars = truncate_chars
+        self.token_counter = token_counter
+        self._messages: List[BaseMessage] = []
+        self._tokens: List[int] = []
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """現在の履歴（コピー）"""
+        return list(self._messages)
+
+    @property
+    def total_tokens(self) -> int:
+        """履歴全体の推定トークン数"""
+        return sum(self._tokens)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add_message(self, message: BaseMessage):
+        """メッセージを追加"""
+        self._messages.append(message)
+        self._tokens.append(self.token_counter(_message_text(message)))
+
+    def add_turn(self, user_input: str, output: str):
+        """ユーザー入力と応答の1ターンを追加"""
+        self.add_message(HumanMessage(content=user_input))
+        self.add_message(AIMessage(content=output))
+
+    def clear(self):
+        """履歴を消去"""
+        self._messages.clear()
+        self._tokens.clear()
+
+    def get_messages(self) -> List[BaseMessage]:
+        """必要に応じて圧縮した上で、送信用の履歴を返す"""
+        if self.total_tokens > self.max_tokens:
+            self.compact()
+        return self.messages
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """get_messages()の非同期版（圧縮は別スレッドで行う）"""
+        if self.total_tokens > self.max_tokens:
+            await asyncio.to_thread(self.compact)
+        return self.messages
+
+    # ------------------------------------------------------------------
+    # 圧縮
+    # ------------------------------------------------------------------
+    def compact(self):
+        """予算内に収まるよう古いターンを圧縮する"""
+        if self.strategy == "summarize" and self.summarizer is not None:
+            try:
+                self._summarize()
+            except Exception as e:
+                print(f"⚠️ 履歴の要約に失敗したため古いターンを削除します: {e}")
+        elif self.strategy == "truncate":
+            self._truncate()
+        self._drop()
+
+    def _compactable_count(self) -> int:
+        """圧縮してよい先頭からのメッセージ数（直近のターンは残す）"""
+        return max(0, len(self._messages) - self.keep_recent_turns * 2)
+
+    def _drop(self):
+        while self.total_tokens > self.max_tokens and self._compactable_count() >= 2:
+            # 人間と応答の組を崩さないように2件ずつ削除
+            del self._messages[:2]
+            del self._tokens[:2]
+
+    def _truncate(self):
+        for i in range(self._compactable_count()):
+            if self.total_tokens <= self.max_tokens:
+                return
+            text = _message_text(self._messages[i])
+            if len(text) <= self.truncate_chars:
+                continue
+            shortened = text[:self.truncate_chars] + "…（省略）"
+            self._messages[i] = self._messages[i].__class__(content=shortened)
+            self._tokens[i] = self.token_counter(shortened)
+
+    def _summarize(self):
+        count = self._compactable_count()
+        if count < 2:
+            return
+        old = self._messages[:count]
+        summary = self.summarizer(old)
+        recent = self._messages[count:]
+        self.clear()
+        # Anthropicは途中のsystemメッセージを受け付けないため人間/応答の組として保持する
+        self.add_message(HumanMessage(content=f"{SUMMARY_PREFIX}\n{summary}"))
+        self.add_message(AIMessage(content=SUMMARY_ACK))
+        for message in recent:
+            self.add_message(message)
@@ -0,0 +1,337 @@
+"""Code Interpreterセッションプール
+
+複数のCode Interpreterサンドボックスを保持し、ツール呼び出しごとにリースして使い回す。
+同じ会話（セッションキー）からの呼び出しは同じサンドボックスに割り当てられるため、
+保存したファイルや変数は会話内で引き継がれる。
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 現在の会話を識別するキー（ツールはこのキーでサンドボックスを選ぶ）
+_SESSION_KEY: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "code_interpreter_session_key", default="default"
+)
+
+
+def get_session_key() -> str:
+    """現在のコンテキストのセッションキーを取得"""
+    return _SESSION_KEY.get()
+
+
+def set_session_key(key: str) -> contextvars.Token:
+    """現在のコンテキストのセッションキーを設定"""
+    return _SESSION_KEY.set(key)
+
+
+class PooledSession:
+    """プールが管理する1つのCode Interpreterセッション"""
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.pool_id = uuid.uuid4().hex[:8]
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+        self.use_count = 0
+        self.key: Optional[str] = None
+        self.leased = False
+        # このサンドボックスにアップロードしたファイルの索引
+        # （内容のSHA-256 → {パス: (サイズ, 更新時刻ns)}）。セッションとともに破棄される
+        self.file_index: Dict[str, Dict[str, Tuple[int, int]]] = {}
+
+    def invoke(self, method: str, params: Optional[Dict] = None):
+        """Code Interpreterのメソッドを呼び出す"""
+        return self.client.invoke(method, params)
+
+    def stop(self):
+        """リモートセッションを停止（失敗は無視）"""
+        self.file_index.clear()
+        try:
+            self.client.stop()
+        except Exception:
+            pass
+
+
+class CodeInterpreterPool:
+    """Code Interpreterセッションのプール
+
+    Args:
+        factory: 起動済みのCode Interpreterクライアントを返す関数
+        min_size: 常に保持するセッション数
+        max_size: 同時に保持できるセッションの上限
+        idle_timeout: この秒数使われなかったセッションは停止する
+        health_check_interval: この秒数以上チェックしていないセッションはリース前に確認する
+        acquire_timeout: セッションが空くまで待つ最大秒数
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        min_size: int = 0,
+        max_size: int = 4,
+        idle_timeout: float = 600.0,
+        health_check_interval: float = 300.0,
+        acquire_timeout: float = 120.0,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("min_size/max_size の指定が不正です")
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._sessions: List[PooledSession] = []
+        self._by_key: Dict[str, PooledSession] = {}
+        self._starting = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._warm_up: Optional[Future] = None
+        self.stats = {"created": 0, "evicted": 0, "reaped": 0, "leases": 0}
+
+    # ------------------------------------------------------------------
+    # リース
+    # ------------------------------------------------------------------
+    @contextmanager
+    def lease(self, key: Optional[str] = None) -> Iterator[PooledSession]:
+        """セッションを借りる。ブロック内で例外が発生した場合はセッションを破棄する"""
+        session = self._acquire(key or get_session_key())
+        try:
+            yield session
+        except BaseException:
+            self.evict(session)
+            raise
+        else:
+            self._release(session)
+
+    def _acquire(self, key: str) -> PooledSession:
+        self._ensure_reaper()
+        self._wait_for_warm_up()
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            session = self._reserve(key, deadline)
+            if session is None:
+                session = self._start_session(key)
+            if self._is_healthy(session):
+                session.use_count += 1
+                self.stats["leases"] += 1
+                return session
+            self.evict(session)
+
+    def _reserve(self, key: str, deadline: float) -> Optional[PooledSession]:
+        """既存セッションを確保する。新規作成すべき場合はNoneを返す"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Code Interpreterプールは停止済みです")
+
+                bound = self._by_key.get(key)
+                if bound is not None:
+                    # 同じ会話のセッションが使用中なら空くまで待つ
+                    if not bound.leased:
+                        bound.leased = True
+                        return bound
+                else:
+                    free = [s for s in self._sessions if not s.leased and s.key is None]
+                    if free:
+                        return self._bind(free[0], key)
+                    if len(self._sessions) + self._starting < self.max_size:
+                        self._starting += 1
+                        return None
+                    # 上限に達している場合は最も古いアイドルセッションを譲り受ける
+                    idle = [s for s in self._sessions if not s.leased]
+                    if idle:
+                        victim = min(idle, key=lambda s: s.last_used)
+                        self._by_key.pop(victim.key, None)
+                        return self._bind(victim, key)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Code Interpreterセッションの取得がタイムアウトしました")
+                self._cond.wait(remaining)
+
+    def _bind(self, session: PooledSession, key: str) -> PooledSession:
+        session.key = key
+        session.leased = True
+        self._by_key[key] = session
+        return session
+
+    def _start_session(self, key: Optional[str]) -> PooledSession:
+        """新しいセッションを起動してプールに登録する（_startingを確保済みであること）"""
+        try:
+            session = PooledSession(self._factory())
+        except BaseException:
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._starting -= 1
+            self._sessions.append(session)
+            self.stats["created"] += 1
+            if key is not None:
+                self._bind(session, key)
+            self._cond.notify_all()
+        return session
+
+    def _release(self, session: PooledSession):
+        with self._cond:
+            session.leased = False
+            session.last_used = time.monotonic()
+            self._cond.notify_all()
+
+    def _is_healthy(self, session: PooledSession) -> bool:
+        """一定時間チェックしていないセッションに軽量コードを実行して生存確認する"""
+        if time.monotonic() - session.last_checked < self.health_check_interval:
+            return True
+        try:
+            response = session.invoke("executeCode", {"language": "python", "code": "pass"})
+            for _ in response.get("stream", []):
+                pass
+        except Exception:
+            return False
+        session.last_checked = time.monotonic()
+        return True
+
+    # ------------------------------------------------------------------
+    # 破棄・回収
+    # ------------------------------------------------------------------
+    def evict(self, session: PooledSession):
+        """セッションをプールから取り除いて停止する"""
+        with self._cond:
+            if session in self._sessions:
+                self._sessions.remove(session)
+                self.stats["evicted"] += 1
+            if session.key is not None and self._by_key.get(session.key) is session:
+                del self._by_key[session.key]
+            self._cond.notify_all()
+        session.stop()
+
+    def reap_idle(self) -> int:
+        """idle_timeoutを超えて使われていないセッションを停止する"""
+        now = time.monotonic()
+        with self._cond:
+            idle = sorted(
+                (s for s in self._sessions
+                 if not s.leased and now - s.last_used > self.idle_timeout),
+                key=lambda s: s.last_used,
+            )
+            surplus = max(0, len(self._sessions) - self.min_size)
+            victims = idle[:surplus]
+            for session in victims:
+                self._sessions.remove(session)
+                if session.key is not None and self._by_key.get(session.key) is session:
+                    del self._by_key[session.key]
+            self.stats["reaped"] += len(victims)
+        for session in victims:
+            session.stop()
+        return len(victims)
+
+    def ensure_min_size(self):
+        """min_sizeに満たない分のセッションを起動する"""
+        while True:
+            with self._cond:
+                if self._closed or len(self._sessions) + self._starting >= self.min_size:
+                    return
+                self._starting += 1
+            self._start_session(None)
+
+    # ------------------------------------------------------------------
+    # ウォームアップ
+    # ------------------------------------------------------------------
+    def warm_up(self, size: Optional[int] = None) -> Future:
+        """バックグラウンドスレッドでセッションを起動する
+
+        Args:
+            size: 起動しておくセッション数（省略時はmin_sizeと1の大きい方）
+
+        Returns:
+            Future: 起動が終わると保持セッション数を結果に持つ
+        """
+        with self._cond:
+            if self._warm_up is not None:
+                return self._warm_up
+            future: Future = Future()
+            self._warm_up = future
+        target = min(self.max_size, size if size is not None else max(self.min_size, 1))
+        threading.Thread(
+            target=self._run_warm_up, args=(future, target),
+            name="code-interpreter-warm-up", daemon=True,
+        ).start()
+        return future
+
+    def _run_warm_up(self, future: Future, target: int):
+        with self._cond:
+            count = max(0, target - len(self._sessions) - self._starting)
+            self._starting += count
+        # 複数セッションは並列に起動する
+        errors: List[BaseException] = []
+        threads = [
+            threading.Thread(target=self._start_for_warm_up, args=(errors,), daemon=True)
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors and len(errors) == count:
+            future.set_exception(errors[0])
+        else:
+            future.set_result(self.size())
+
+    def _start_for_warm_up(self, errors: List[BaseException]):
+        try:
+            self._start_session(None)
+        except BaseException as e:
+            errors.append(e)
+
+    def _wait_for_warm_up(self):
+        """ウォームアップ中であれば完了を待つ（失敗時はその場で起動する）"""
+        future = self._warm_up
+        if future is None or future.done():
+            return
+        try:
+            future.result(timeout=self.acquire_timeout)
+        except Exception:
+            pass
+
+    def _ensure_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap_loop, name="code-interpreter-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1.0, min(self.idle_timeout, self.health_check_interval) / 2)
+        while not self._stop_event.wait(interval):
+            self.reap_idle()
+
+    def shutdown(self):
+        """全セッションを停止してプールを閉じる"""
+        with self._cond:
+            self._closed = True
+            self._stop_event.set()
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._by_key.clear()
+            self._cond.notify_all()
+        for session in sessions:
+            session.stop()
+
+    def size(self) -> int:
+        """現在保持しているセッション数"""
+        with self._cond:
+            return len(self._sessions)
@@ -0,0 +1,258 @@
+"""Code Interpreterセッションとのファイル転送
+
+executeCodeしか使えない環境でも大きなファイルやバイナリを正しく転送できるよう、
+内容をチャンクに分けてzlib圧縮・base64エンコードし、Pythonのリテラルとして送る。
+コードに内容を直接埋め込まないため、引用符やバックスラッシュを含む内容でも壊れない。
+
+アップロードは一時ファイル（<path>.part）に追記していき、最後にSHA-256を照合してから
+本来のパスに置き換える。途中で失敗した場合は、次回のアップロードで一時ファイルの
+内容が手元のデータの先頭と一致すればその続きから再開する。
+セッションごとの索引を渡すと、同じ内容をアップロード済みのファイルがあれば送信を省略する。
+
+ダウンロードも同様に、オフセットと長さを指定してチャンクごとに読み出し、
+ローカルのキャッシュディレクトリに保存してからSHA-256を照合する。
+キャッシュのファイル名には内容のハッシュを含めるため、同じ内容は再取得しない。
+"""
+import base64
+import hashlib
+import json
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+# コードを実行して (stdout, stderr) を返す関数（同じセッションで実行されること）
+CodeRunner = Callable[[str], Tuple[str, str]]
+
+# セッションにアップロードしたファイルの索引（内容のSHA-256 → {パス: (サイズ, 更新時刻ns)}）
+FileIndex = Dict[str, Dict[str, Tuple[int, int]]]
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# リモートのスクリプトが結果を出力する行の目印
+_RESULT_MARKER = "__file_transfer__"
+
+
+class TransferError(RuntimeError):
+    """ファイル転送の失敗（検証エラーを含む）"""
+
+
+def _call(run: CodeRunner, code: str) -> dict:
+    """スクリプトを実行し、目印付きで出力されたJSONを返す"""
+    stdout, stderr = run(code)
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(_RESULT_MARKER):
+            return json.loads(line[len(_RESULT_MARKER):])
+    raise TransferError((stderr or stdout).strip() or "転送スクリプトの結果を取得できませんでした")
+
+
+def _script(body: str) -> str:
+    """共通のインポートと結果出力の関数を付けたスクリプト"""
+    return (
+        "import base64, hashlib, json, os, zlib\n"
+        "def _sha256(p):\n"
+        "    h = hashlib.sha256()\n"
+        "    with open(p, 'rb') as f:\n"
+        "        for b in iter(lambda: f.read(1 << 20), b''):\n"
+        "            h.update(b)\n"
+        "    return h.hexdigest()\n"
+        f"def _result(**kw):\n"
+        f"    print({_RESULT_MARKER!r} + json.dumps(kw))\n"
+        f"{body}"
+    )
+
+
+def _encode(chunk: bytes, compress: bool) -> Tuple[str, str]:
+    """チャンクを送信用の文字列にする（圧縮で小さくならない場合は無圧縮）"""
+    if compress:
+        packed = zlib.compress(chunk, 6)
+        if len(packed) < len(chunk):
+            return "zlib", base64.b64encode(packed).decode("ascii")
+    return "raw", base64.b64encode(chunk).decode("ascii")
+
+
+def upload_bytes(run: CodeRunner, path: str, data: bytes,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, compress: bool = True,
+                 index: Optional[FileIndex] = None) -> Dict:
+    """データをセッション内のファイルにアップロードする
+
+    indexを渡すと、同じ内容を以前アップロードしたファイルがセッション内に残っていれば
+    データを送らずにリモートでコピーする（保存先が同じなら何もしない）。
+    索引のファイルはサイズと更新時刻が記録時と一致する場合のみ信頼する。
+
+    Args:
+        run: セッションでコードを実行する関数
+        path: 保存先のパス
+        data: アップロードする内容
+        chunk_size: 1回の実行で送るチャンクの大きさ（圧縮前のバイト数）
+        compress: チャンクをzlib圧縮するか
+        index: セッションのアップロード済みファイルの索引（アップロード後に更新する）
+
+    Returns:
+        dict: size, sha256, sent（送信した文字数）, chunks, resumed_from, copied_from
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    part = f"{path}.part"
+    candidates = {p: list(stat) for p, stat in (index or {}).get(digest, {}).items()}
+
+    state = _call(run, _script(
+        f"p, part, size, candidates = {path!r}, {part!r}, {len(data)}, {candidates!r}\n"
+        "def _stat(q):\n"
+        "    st = os.stat(q) if os.path.isfile(q) else None\n"
+        "    return [st.st_size, st.st_mtime_ns] if st else None\n"
+        "valid = [q for q, stat in candidates.items() if _stat(q) == stat]\n"
+        "# 保存先が索引で確認できなければ、サイズが同じ場合のみハッシュを計算する\n"
+        "same = p in valid or ((_stat(p) or [None])[0] == size\n"
+        f"                     and _sha256(p) == {digest!r})\n"
+        "_result(same=same, stat=_stat(p), valid=valid,\n"
+        "        part_size=os.path.getsize(part) if os.path.isfile(part) else 0,\n"
+        "        part_sha256=_sha256(part) if os.path.isfile(part) else None)\n"
+    ))
+    result = {"size": len(data), "sha256": digest, "sent": 0, "chunks": 0,
+              "resumed_from": 0, "copied_from": None}
+    if state["same"]:
+        _record(index, digest, path, state["stat"])
+        return dict(result, resumed_from=len(data))
+
+    if state["valid"]:
+        # 同じ内容のファイルがセッション内にあればコピーする
+        source = state["valid"][0]
+        copied = _call(run, _script(
+            f"src, part = {source!r}, {part!r}\n"
+            "import shutil\n"
+            "os.makedirs(os.path.dirname(os.path.abspath(part)), exist_ok=True)\n"
+            "shutil.copyfile(src, part)\n"
+            "_result(size=os.path.getsize(part))\n"
+        ))
+        if copied["size"] != len(data):
+            raise TransferError(f"コピーしたファイルのサイズが一致しません（{copied['size']} != {len(data)}）")
+        result["copied_from"] = source
+    else:
+        # 途中まで送った一時ファイルが手元のデータの先頭と一致すれば続きから送る
+        offset = state["part_size"]
+        if offset and (offset > len(data)
+                       or hashlib.sha256(data[:offset]).hexdigest() != state["part_sha256"]):
+            offset = 0
+        result["resumed_from"] = offset
+
+        while offset < len(data) or (offset == 0 and result["chunks"] == 0):
+            chunk = data[offset:offset + chunk_size]
+            codec, payload = _encode(chunk, compress)
+            decode = "zlib.decompress(base64.b64decode(d))" if codec == "zlib" else "base64.b64decode(d)"
+            written = _call(run, _script(
+                f"part, d = {part!r}, {payload!r}\n"
+                "os.makedirs(os.path.dirname(os.path.abspath(part)), exist_ok=True)\n"
+                f"with open(part, {'ab' if offset else 'wb'!r}) as f:\n"
+                f"    f.write({decode})\n"
+                "_result(size=os.path.getsize(part))\n"
+            ))
+            offset += len(chunk)
+            if written["size"] != offset:
+                raise TransferError(f"チャンクの書き込みサイズが一致しません（{written['size']} != {offset}）")
+            result["sent"] += len(payload)
+            result["chunks"] += 1
+
+    final = _call(run, _script(
+        f"p, part, expected = {path!r}, {part!r}, {digest!r}\n"
+        "actual = _sha256(part)\n"
+        "if actual == expected:\n"
+        "    os.replace(part, p)\n"
+        "    st = os.stat(p)\n"
+        "    _result(sha256=actual, stat=[st.st_size, st.st_mtime_ns])\n"
+        "else:\n"
+        "    os.remove(part)\n"
+        "    _result(sha256=actual, stat=None)\n"
+    ))
+    if final["sha256"] != digest:
+        raise TransferError(f"アップロード後のSHA-256が一致しません（{final['sha256']} != {digest}）")
+    _record(index, digest, path, final["stat"])
+    return result
+
+
+def _record(index: Optional[FileIndex], digest: str, path: str, stat: Optional[List[int]]):
+    """アップロードしたファイルを索引に登録する（同じパスの古い内容の登録は消す）"""
+    if index is None or stat is None:
+        return
+    for digest_, paths in list(index.items()):
+        if paths.pop(path, None) is not None and not paths:
+            del index[digest_]
+    index.setdefault(digest, {})[path] = tuple(stat)
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def download_file(run: CodeRunner, path: str, directory: str,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, compress: bool = True) -> Dict:
+    """セッション内のファイルをローカルのキャッシュディレクトリにダウンロードする
+
+    Args:
+        run: セッションでコードを実行する関数
+        path: ダウンロードするファイルのパス（セッション内）
+        directory: 保存先のキャッシュディレクトリ
+        chunk_size: 1回の実行で受け取るチャンクの大きさ（圧縮前のバイト数）
+        compress: チャンクをzlib圧縮して受け取るか
+
+    Returns:
+        dict: local_path, size, sha256, received（受信した文字数）, chunks, cached
+
+    Raises:
+        FileNotFoundError: ファイルが存在しない場合
+    """
+    state = _call(run, _script(
+        f"p = {path!r}\n"
+        "if os.path.isfile(p):\n"
+        "    _result(size=os.path.getsize(p), sha256=_sha256(p))\n"
+        "else:\n"
+        "    _result(size=None, sha256=None)\n"
+    ))
+    if state["sha256"] is None:
+        raise FileNotFoundError(f"ファイル '{path}' が見つかりませんでした")
+    size, digest = state["size"], state["sha256"]
+
+    local_path = os.path.join(directory, f"{digest[:16]}-{os.path.basename(path) or 'file'}")
+    if os.path.isfile(local_path):
+        return {"local_path": local_path, "size": size, "sha256": digest,
+                "received": 0, "chunks": 0, "cached": True}
+
+    # 同じ内容の途中までのダウンロードが残っていれば続きから受け取る
+    os.makedirs(directory, exist_ok=True)
+    part = f"{local_path}.part"
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    if offset > size:
+        offset = 0
+    received = chunks = 0
+    with open(part, "r+b" if offset else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+        while offset < size:
+            result = _call(run, _script(
+                f"p, offset, length, compress = {path!r}, {offset}, {chunk_size}, {compress}\n"
+                "with open(p, 'rb') as f:\n"
+                "    f.seek(offset)\n"
+                "    b = f.read(length)\n"
+                "z = zlib.compress(b, 6) if compress else b\n"
+                "codec = 'zlib' if len(z) < len(b) else 'raw'\n"
+                "_result(codec=codec, data=base64.b64encode(z if codec == 'zlib' else b).decode('ascii'))\n"
+            ))
+            chunk = base64.b64decode(result["data"])
+            if result["codec"] == "zlib":
+                chunk = zlib.decompress(chunk)
+            if not chunk:
+                raise TransferError(f"ファイル '{path}' が転送中に短くなりました")
+            f.write(chunk)
+            offset += len(chunk)
+            received += len(result["data"])
+            chunks += 1
+
+    actual = _sha256_file(part)
+    if actual != digest:
+        os.remove(part)
+        raise TransferError(f"ダウンロード後のSHA-256が一致しません（{actual} != {digest}）")
+    os.replace(part, local_path)
+    return {"local_path": local_path, "size": size, "sha256": digest,
+            "received": received, "chunks": chunks, "cached": False}
@@ -0,0 +1,210 @@
+"""LLM応答キャッシュ
+
+ChatAnthropicの `cache` に渡して使うLangChain互換のキャッシュ。
+キーはモデル設定・温度・バインドされたツールスキーマ（llm_string）と、
+正規化したメッセージ列から計算する。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from abc import abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+# 実行ごとに変わるためキーから除外するメッセージの項目
+_VOLATILE_MESSAGE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+
+def _strip_volatile(value: Any) -> Any:
+    """シリアライズ済みメッセージから実行ごとに変わる項目を取り除く"""
+    if isinstance(value, dict):
+        return {
+            k: _strip_volatile(v) for k, v in value.items()
+            if k not in _VOLATILE_MESSAGE_FIELDS
+        }
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def make_cache_key(prompt: str, llm_string: str) -> str:
+    """プロンプトとLLM設定からキャッシュキーを計算"""
+    try:
+        normalized = json.dumps(_strip_volatile(json.loads(prompt)), sort_keys=True,
+                                ensure_ascii=False)
+    except (TypeError, ValueError):
+        normalized = prompt
+    digest = hashlib.sha256()
+    digest.update(llm_string.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalized.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache(BaseCache):
+    """TTLとヒット/ミスカウンタを持つキャッシュの基底クラス
+
+    Args:
+        ttl: エントリの有効期間（秒）。Noneの場合は期限なし
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        entry = self._get(make_cache_key(prompt, llm_string))
+        value = None
+        if entry is not None:
+            stored_at, value = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                value = None
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self._set(make_cache_key(prompt, llm_string), time.time(), return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self._clear()
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット数・ミス数を取得"""
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Tuple[float, RETURN_VAL_TYPE]]:
+        """(保存時刻, 値) を返す。存在しない場合はNone"""
+
+    @abstractmethod
+    def _set(self, key: str, stored_at: float, value: RETURN_VAL_TYPE) -> None:
+        """値を保存する"""
+
+    @abstractmethod
+    def _clear(self) -> None:
+        """全エントリを削除する"""
+
+
+class MemoryResponseCache(ResponseCache):
+    """プロセス内のLRUキャッシュ
+
+    Args:
+        maxsize: 保持する最大エントリ数
+        ttl: エントリの有効期間（秒）
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, RETURN_VAL_TYPE]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Tuple[float, RETURN_VAL_TYPE]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key: str, stored_at: float, value: RETURN_VAL_TYPE) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """SQLiteファイルに保存する永続キャッシュ
+
+    Args:
+        path: データベースファイルのパス
+        ttl: エントリの有効期間（秒）
+    """
+
+    def __init__(self, path: str = ".llm_cache.sqlite", ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def _get(self, key: str) -> Optional[Tuple[float, RETURN_VAL_TYPE]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, value FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with warnings.catch_warnings():
+                # langchain_core.load.loadsのベータ版警告を抑制
+                warnings.simplefilter("ignore")
+                return row[0], [loads(g) for g in json.loads(row[1])]
+        except Exception:
+            # 読み込めないエントリはミス扱い
+            return None
+
+    def _set(self, key: str, stored_at: float, value: RETURN_VAL_TYPE) -> None:
+        payload = json.dumps([dumps(g) for g in value])
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, payload, stored_at),
+            )
+            if self.ttl is not None:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE stored_at < ?", (stored_at - self.ttl,)
+                )
+
+    def _clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+
+def create_llm_cache(backend: Optional[str] = None) -> Optional[ResponseCache]:
+    """設定に応じたキャッシュを作成（無効の場合はNone）
+
+    Args:
+        backend: "memory" / "sqlite" / "none"（省略時は環境変数 LLM_CACHE）
+    """
+    backend = (backend or os.getenv("LLM_CACHE", "none")).lower()
+    ttl_value = os.getenv("LLM_CACHE_TTL", "3600")
+    ttl = float(ttl_value) if ttl_value else None
+
+    if backend == "memory":
+        return MemoryResponseCache(
+            maxsize=int(os.getenv("LLM_CACHE_MAXSIZE", "256")), ttl=ttl
+        )
+    if backend == "sqlite":
+        return SQLiteResponseCache(
+            path=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite"), ttl=ttl
+        )
+    if backend in ("", "none", "off", "false"):
+        return None
+    raise ValueError(f"不明なLLMキャッシュバックエンドです: {backend}")
@@ -0,0 +1,395 @@
+"""ローカルのサブプロセスでPythonコードを実行するCode Interpreter互換バックエンド
+
+bedrock_agentcoreのCodeInterpreterと同じインターフェース（start / stop / invoke）を持ち、
+invoke("executeCode", ...) は同じ形のイベントストリームを返す。そのためCode Interpreter
+プールやツールからはリモートのサンドボックスと区別なく扱える。
+
+セッションごとに1つのワーカープロセスと一時作業ディレクトリを割り当てる。
+ワーカーは永続的なカーネルとして動作し、変数やインポートしたモジュールは同じ
+セッションの以降のexecuteCodeに引き継がれる。起動時には設定されたモジュール
+（pandasなど）を事前にインポートしておく。
+ワーカーはメモリ・ファイルサイズの上限（rlimit）付きで起動し、実行時間の上限を
+超えた場合は強制終了する。LocalInterpreterFactoryは予備のワーカーを事前に起動
+（事前インポートまで完了）しておくため、新しいセッションの開始に待ち時間がかからない。
+
+注意: 同じマシン上のプロセスで実行するため、信頼できる利用者向けの環境でのみ使うこと。
+"""
+import builtins
+import codecs
+import collections
+import io
+import json
+import os
+import re
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows: rlimitによる制限なし
+    resource = None
+
+# ワーカーに引き継がない環境変数（APIキーや認証情報）
+_SECRET_ENV_PATTERN = re.compile(r"KEY|SECRET|TOKEN|PASSWORD|CREDENTIAL", re.IGNORECASE)
+
+# 事前インポートの指定（"pandas" や "matplotlib.pyplot as plt"）
+_PREIMPORT_PATTERN = re.compile(r"^([A-Za-z_][\w.]*)(?:\s+as\s+([A-Za-z_]\w*))?$")
+
+
+def parse_preimports(spec: str) -> List[str]:
+    """カンマ区切りの事前インポート指定を検証してリストにする"""
+    entries = [" ".join(entry.split()) for entry in spec.split(",") if entry.strip()]
+    for entry in entries:
+        if not _PREIMPORT_PATTERN.match(entry):
+            raise ValueError(f"事前インポートの指定が正しくありません: {entry}")
+    return entries
+
+
+class LocalCodeInterpreter:
+    """ローカルのワーカープロセスで1セッション分のコードを実行する
+
+    Args:
+        timeout: 1回のexecuteCodeの実行時間の上限（秒）
+        memory_mb: ワーカーのアドレス空間の上限（MB、0で無制限）
+        file_size_mb: ワーカーが書き込めるファイルサイズの上限（MB、0で無制限）
+        preimports: 起動時にインポートしておくモジュール（例: ["numpy as np", "pandas as pd"]）
+        startup_timeout: 起動と事前インポートを待つ最大秒数
+    """
+
+    def __init__(self, timeout: float = 300.0, memory_mb: int = 2048, file_size_mb: int = 512,
+                 preimports: Sequence[str] = (), startup_timeout: float = 120.0):
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.file_size_mb = file_size_mb
+        self.preimports = list(preimports)
+        self.startup_timeout = startup_timeout
+        self.workdir: Optional[str] = None
+        # 起動時に報告された事前インポートの結果
+        self.kernel_info: Optional[dict] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """作業ディレクトリを作成してワーカープロセスを起動する（準備完了は待たない）"""
+        self.workdir = tempfile.mkdtemp(prefix="code-interpreter-")
+        self.kernel_info = None
+        self._buffer.clear()
+        config = {"memory_mb": self.memory_mb, "file_size_mb": self.file_size_mb,
+                  "preimports": self.preimports}
+        env = {k: v for k, v in os.environ.items() if not _SECRET_ENV_PATTERN.search(k)}
+        env.setdefault("MPLBACKEND", "Agg")
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), "--worker", json.dumps(config)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=self.workdir,
+            env=env,
+        )
+
+    def wait_ready(self):
+        """ワーカーの起動と事前インポートの完了を待つ"""
+        with self._lock:
+            self._wait_ready()
+
+    def _wait_ready(self):
+        if self.kernel_info is not None:
+            return
+        if self._proc is None:
+            raise RuntimeError("ローカル実行ワーカーが起動していません")
+        try:
+            self.kernel_info = json.loads(self._read_line(self.startup_timeout))
+        except TimeoutError:
+            self._proc.kill()
+            raise TimeoutError("ローカル実行ワーカーの起動がタイムアウトしました") from None
+
+    def stop(self):
+        """ワーカープロセスを終了して作業ディレクトリを削除する"""
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=2)
+            except Exception:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def invoke(self, method: str, params: Optional[Dict] = None) -> Dict[str, Any]:
+        """Code Interpreterのメソッドを呼び出す（executeCodeのみ対応）
+
+        返すストリームは読み進めるとコードを実行し、標準出力・標準エラーを
+        届いた分ずつイベントとして返す。最後のイベントに終了コードが入る。
+        """
+        if method != "executeCode":
+            raise ValueError(f"ローカル実行バックエンドは {method} に対応していません")
+        params = params or {}
+        if params.get("language", "python") != "python":
+            raise ValueError(f"対応していない言語です: {params.get('language')}")
+        return {"stream": self._execute_stream(params.get("code", ""))}
+
+    def _execute_stream(self, code: str) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            finished = False
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    raise RuntimeError("ローカル実行ワーカーが起動していません")
+                self._wait_ready()
+                request = json.dumps({"code": code}) + "\n"
+                try:
+                    self._proc.stdin.write(request.encode("utf-8"))
+                    self._proc.stdin.flush()
+                except BrokenPipeError as e:
+                    raise RuntimeError("ローカル実行ワーカーが終了しました") from e
+
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    try:
+                        message = json.loads(self._read_line(deadline - time.monotonic()))
+                    except TimeoutError:
+                        raise TimeoutError(
+                            f"コードの実行が{self.timeout:g}秒を超えたため中断しました"
+                        ) from None
+                    finished = "exitCode" in message
+                    yield _result_event(message)
+                    if finished:
+                        return
+            finally:
+                if not finished and self._proc is not None:
+                    # 実行中のコードは止められず、残りの応答で通信の同期も崩れるためワーカーごと終了させる
+                    self._proc.kill()
+
+    def _read_line(self, timeout: float) -> bytes:
+        """ワーカーから応答を1行読む"""
+        deadline = time.monotonic() + timeout
+        fd = self._proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise RuntimeError("ローカル実行ワーカーが終了しました")
+            self._buffer += chunk
+        index = self._buffer.index(b"\n")
+        line = bytes(self._buffer[:index])
+        del self._buffer[:index + 1]
+        return line
+
+
+def _result_event(message: dict) -> Dict[str, Any]:
+    """ワーカーの応答をCode InterpreterのexecuteCodeのイベント形式にする"""
+    structured = {"stdout": message.get("stdout", ""), "stderr": message.get("stderr", ""),
+                  **{k: v for k, v in message.items() if k not in ("stdout", "stderr")}}
+    return {"result": {
+        "content": [{"type": "text", "text": structured["stdout"] or structured["stderr"]}],
+        "structuredContent": structured,
+        "isError": structured.get("exitCode", 0) != 0,
+    }}
+
+
+class LocalInterpreterFactory:
+    """起動済みのLocalCodeInterpreterを返すファクトリ（予備のワーカーを事前起動する）
+
+    Args:
+        spares: 事前に起動しておくワーカー数
+        **options: LocalCodeInterpreterに渡すオプション
+    """
+
+    def __init__(self, spares: int = 1, **options):
+        self.spares = spares
+        self.options = options
+        self._spares: Deque[LocalCodeInterpreter] = collections.deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._refill_in_background()
+
+    def __call__(self) -> LocalCodeInterpreter:
+        with self._lock:
+            client = self._spares.popleft() if self._spares else None
+        if client is None:
+            client = self._start()
+        # 使った分の予備はバックグラウンドで補充する
+        self._refill_in_background()
+        return client
+
+    def _refill_in_background(self):
+        threading.Thread(target=self._refill, name="local-interpreter-prefork",
+                         daemon=True).start()
+
+    def _start(self) -> LocalCodeInterpreter:
+        client = LocalCodeInterpreter(**self.options)
+        client.start()
+        try:
+            client.wait_ready()
+        except BaseException:
+            client.stop()
+            raise
+        return client
+
+    def _refill(self):
+        while True:
+            with self._lock:
+                if self._closed or len(self._spares) >= self.spares:
+                    return
+            client = self._start()
+            with self._lock:
+                if not self._closed:
+                    self._spares.append(client)
+                    continue
+            client.stop()
+            return
+
+    def shutdown(self):
+        """予備のワーカーを停止する"""
+        with self._lock:
+            self._closed = True
+            spares = list(self._spares)
+            self._spares.clear()
+        for client in spares:
+            client.stop()
+
+
+# ----------------------------------------------------------------------
+# ワーカープロセス
+# ----------------------------------------------------------------------
+def _apply_limits(config: dict):
+    if resource is None:
+        return
+    limits = [
+        (getattr(resource, "RLIMIT_AS", None), config.get("memory_mb", 0)),
+        (getattr(resource, "RLIMIT_FSIZE", None), config.get("file_size_mb", 0)),
+    ]
+    for limit, megabytes in limits:
+        if limit is None or not megabytes:
+            continue
+        value = megabytes * 1024 * 1024
+        _, hard = resource.getrlimit(limit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(limit, (value, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def _execute(code: str, namespace: dict, stdout_fd: int, stderr_fd: int,
+             send: Optional[Callable[[dict], None]] = None,
+             interval: float = 0.1) -> dict:
+    """コードを実行し、ファイル記述子レベルで標準出力・標準エラーを取り込む
+
+    sendを指定すると、実行中もinterval秒ごとに新しく出力された分を送る。
+    戻り値にはまだ送っていない残りの出力だけが入る。
+    """
+    captured = []
+    saved = []
+    for fd in (stdout_fd, stderr_fd):
+        tmp = tempfile.TemporaryFile()
+        saved.append(os.dup(fd))
+        os.dup2(tmp.fileno(), fd)
+        captured.append(tmp)
+    decoders = [codecs.getincrementaldecoder("utf-8")("replace") for _ in captured]
+    offsets = [0] * len(captured)
+
+    def drain(final: bool = False) -> List[str]:
+        # 書き込み位置を共有しているため、ファイル位置を動かさないpreadで読む
+        texts = []
+        for i, tmp in enumerate(captured):
+            chunks = []
+            while True:
+                data = os.pread(tmp.fileno(), 65536, offsets[i])
+                if not data:
+                    break
+                offsets[i] += len(data)
+                chunks.append(data)
+            texts.append(decoders[i].decode(b"".join(chunks), final=final))
+        return texts
+
+    stop = threading.Event()
+
+    def forward():
+        while not stop.wait(interval):
+            stdout, stderr = drain()
+            if stdout or stderr:
+                send({"stdout": stdout, "stderr": stderr})
+
+    forwarder = None
+    if send is not None:
+        forwarder = threading.Thread(target=forward, daemon=True)
+        forwarder.start()
+
+    exit_code = 0
+    started = time.perf_counter()
+    try:
+        exec(compile(code, "<code>", "exec"), namespace)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        # ワーカー自身のフレームは除いて表示する
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    finally:
+        elapsed = time.perf_counter() - started
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if forwarder is not None:
+            stop.set()
+            forwarder.join()
+        for fd, original in zip((stdout_fd, stderr_fd), saved):
+            os.dup2(original, fd)
+            os.close(original)
+
+    stdout, stderr = drain(final=True)
+    for tmp in captured:
+        tmp.close()
+    return {"stdout": stdout, "stderr": stderr,
+            "exitCode": exit_code, "executionTime": round(elapsed, 6)}
+
+
+def _worker_main(config: dict):
+    _apply_limits(config)
+    # 元の標準入出力は親プロセスとの通信路として使い、ユーザーコードからは切り離す
+    channel_in = os.fdopen(os.dup(0), "rb")
+    channel_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    sys.stdin = open(os.devnull, "r")
+    sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", buffering=0, closefd=False),
+                                  encoding="utf-8", errors="replace", write_through=True)
+    sys.stderr = io.TextIOWrapper(os.fdopen(2, "wb", buffering=0, closefd=False),
+                                  encoding="utf-8", errors="replace", write_through=True)
+
+    def send(message: dict):
+        channel_out.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        channel_out.flush()
+
+    # セッションの間ずっと使い続ける名前空間（変数・インポートが次の実行に引き継がれる）
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    preimported, failed = [], []
+    for entry in config.get("preimports", []):
+        result = _execute(f"import {entry}", namespace, 1, 2)
+        (preimported if result["exitCode"] == 0 else failed).append(entry)
+    send({"ready": True, "preimported": preimported, "failed": failed})
+
+    for line in channel_in:
+        request = json.loads(line)
+        send(_execute(request["code"], namespace, 1, 2, send=send))
+
+
+if __name__ == "__main__" and len(sys.argv) >= 3 and sys.argv[1] == "--worker":
+    _worker_main(json.loads(sys.argv[2]))
@@ -1,24 +1,37 @@
 """LangChain CLI Agent - インタラクティブなAIアシスタント"""
+from __future__ import annotations
+
+import argparse
+import asyncio
 import os
+import subprocess
 import sys
+import threading
+import time
 import traceback
-from typing import List
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, List, Optional
+
+# 起動時間の計測用（--profile-startup）
+_PROCESS_START = time.perf_counter()
 
 from dotenv import load_dotenv
-from pydantic import SecretStr
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_anthropic import ChatAnthropic
-from langchain.schema import HumanMessage, AIMessage
-from tools import get_available_tools
-from prompt_toolkit import prompt
-from prompt_toolkit.history import InMemoryHistory
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.completion import WordCompleter
+
+# langchainやprompt_toolkitなどの重いモジュールは、バナー表示を遅らせないよう
+# 使用する箇所で遅延インポートする
+if TYPE_CHECKING:
+    from langchain_anthropic import ChatAnthropic
+    from langchain_core.caches import BaseCache
+    from chat_history import ChatHistoryManager
+    from parallel_executor import ParallelAgentExecutor
+    from streaming import EventSink
 
 # 環境変数の読み込み
 load_dotenv()
 
+# chat()がエラー時に返す文字列の先頭
+ERROR_PREFIX = "⚠️ エラーが発生しました"
+
 
 def validate_aws_credentials() -> tuple[bool, str]:
     """AWS認証情報の検証"""
@@ -36,48 +49,151 @@ def validate_aws_credentials() -> tuple[bool, str]:
     return True, ""
 
 
+def _format_output(output) -> str:
+    """エージェント出力を文字列に整形"""
+    if isinstance(output, list) and len(output) > 0:
+        # リスト形式の場合、textの内容のみ抽出
+        if isinstance(output[0], dict) and 'text' in output[0]:
+            return output[0]['text']
+        return str(output)
+    if not isinstance(output, str):
+        return str(output)
+    return output
+
+
+def _emit_step_events(chunk: dict, on_event: EventSink):
+    """AgentExecutorのストリームチャンクからツールの開始・終了イベントを発行"""
+    for action in chunk.get("actions", []):
+        on_event({"type": "tool_start", "tool": action.tool,
+                  "input": action.tool_input})
+    for step in chunk.get("steps", []):
+        on_event({"type": "tool_end", "tool": step.action.tool,
+                  "output": str(step.observation)})
+
+
 class LangChainCLIAgent:
     """CLIベースのLangChainエージェント"""
     
-    def __init__(self):
-        """エージェントの初期化"""
-        self.chat_history: List = []
-        self.llm = self._initialize_llm()
+    def __init__(self, warm_up: Optional[bool] = None,
+                 llm_cache: Optional[BaseCache] = None,
+                 streaming: Optional[bool] = None,
+                 background_init: bool = False):
+        """エージェントの初期化
         
-        # AWS認証情報の確認
-        is_valid, error_message = validate_aws_credentials()
-        if not is_valid:
-            print("⚠️ AWS認証確認結果:")
-            print(error_message)
-            print("AWS機能（Python実行）は利用できませんが、他の機能は使用可能です。")
+        Args:
+            warm_up: Code Interpreterをバックグラウンドで事前起動するか
+                （省略時は環境変数 CODE_INTERPRETER_WARMUP に従う）
+            llm_cache: LLM応答キャッシュ（省略時は環境変数 LLM_CACHE に従う）
+            streaming: 応答をトークン単位で逐次表示するか
+                （省略時は環境変数 STREAMING に従う）
+            background_init: LLMやツールの準備をバックグラウンドスレッドで行うか
+                （Trueの場合、最初のchat()が準備の完了を待つ）
+        """
+        if streaming is None:
+            streaming = os.getenv("STREAMING", "false").lower() == "true"
+        self.streaming = streaming
+        self.llm_cache = llm_cache
+        self.code_interpreter_ready: Optional[Future] = None
         
-        self.agent_executor = self._create_agent()
+        self._api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not self._api_key:
+            print("⚠️ ANTHROPIC_API_KEYが設定されていません。")
+            print("環境変数またはプロジェクトルートの.envファイルに設定してください。")
+            sys.exit(1)
+        
+        # AWS認証情報の確認（ローカル実行バックエンドでは不要）
+        if os.getenv("PYTHON_EXECUTION_BACKEND", "agentcore") == "local":
+            is_valid = True
+        else:
+            is_valid, error_message = validate_aws_credentials()
+            if not is_valid:
+                print("⚠️ AWS認証確認結果:")
+                print(error_message)
+                print("AWS機能（Python実行）は利用できませんが、他の機能は使用可能です。")
+        
+        if warm_up is None:
+            warm_up = os.getenv("CODE_INTERPRETER_WARMUP", "false").lower() == "true"
+        
+        self._ready: Future = Future()
+        if background_init:
+            threading.Thread(
+                target=self._initialize_components, args=(warm_up and is_valid,),
+                name="agent-init", daemon=True
+            ).start()
+        else:
+            self._initialize_components(warm_up and is_valid)
+            self._ready.result()
         
         # prompt_toolkitの設定
+        from prompt_toolkit.history import InMemoryHistory
+        from prompt_toolkit.completion import WordCompleter
         self.input_history = InMemoryHistory()
         self.completions = WordCompleter([
             '天気', '計算', 'TODO', 'Python', 'グラフ', 'データ', 
             'exit', 'quit', '終了'
         ])
     
+    def _initialize_components(self, warm_up: bool):
+        """LLM・履歴・ツール・エージェントの準備（重いモジュールのインポートを含む）"""
+        try:
+            if self.llm_cache is None:
+                from llm_cache import create_llm_cache
+                self.llm_cache = create_llm_cache()
+            self.llm = self._initialize_llm()
+            self.history = self.create_history()
+            
+            if warm_up:
+                from tools import warm_up_code_interpreter
+                # ユーザーが最初のプロンプトを入力している間にセッションを起動しておく
+                self.code_interpreter_ready = warm_up_code_interpreter()
+            
+            self.agent_executor = self._create_agent()
+        except BaseException as e:
+            self._ready.set_exception(e)
+        else:
+            self._ready.set_result(True)
+    
+    def wait_until_ready(self):
+        """バックグラウンドでの準備が終わるまで待つ（失敗していれば例外を送出）"""
+        self._ready.result()
+    
     def _initialize_llm(self) -> ChatAnthropic:
         """LLMの初期化"""
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            print("⚠️ ANTHROPIC_API_KEYが設定されていません。")
-            print("環境変数またはプロジェクトルートの.envファイルに設定してください。")
-            sys.exit(1)
+        from pydantic import SecretStr
+        from langchain_anthropic import ChatAnthropic
         
         return ChatAnthropic(
             model_name="claude-3-5-haiku-20241022",
             temperature=0.7,
-            api_key=SecretStr(api_key),
+            api_key=SecretStr(self._api_key),
             timeout=10,
-            stop=None
+            stop=None,
+            cache=self.llm_cache
         )
     
-    def _create_agent(self) -> AgentExecutor:
+    def create_history(self) -> ChatHistoryManager:
+        """トークン予算付きチャット履歴の作成（会話ごとに1つ使う）"""
+        from chat_history import ChatHistoryManager, make_llm_summarizer
+        return ChatHistoryManager(
+            max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "8000")),
+            strategy=os.getenv("HISTORY_COMPACTION", "summarize"),
+            keep_recent_turns=int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "2")),
+            summarizer=make_llm_summarizer(self.llm)
+        )
+    
+    @property
+    def chat_history(self) -> List:
+        """現在のチャット履歴"""
+        self.wait_until_ready()
+        return self.history.messages
+    
+    def _create_agent(self) -> ParallelAgentExecutor:
         """エージェントの作成"""
+        from langchain.agents import create_tool_calling_agent
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from parallel_executor import ParallelAgentExecutor
+        from tools import get_available_tools
+        
         # ツールの取得
         tools = get_available_tools()
         
@@ -88,9 +204,11 @@ class LangChainCLIAgent:
             
             利用可能なツール:
             1. get_weather_info: 天気情報の取得
-            2. calculate_math_expression: 数式の計算
-            3. create_todo_item: TODOアイテムの作成
-            4. execute_python_code: AWS Code Interpreterを使用したPythonコード実行
+            2. calculate_math_expression / calculate_math_table: 数式の計算（変数の範囲に対する表・最大最小は一括計算）
+            3. create_todo_item / create_todo_items: TODOアイテムの作成（複数ある場合は一括作成）
+            4. list_todo_items / update_todo_item / complete_todo_item / delete_todo_item: TODOアイテムの検索・変更・完了・削除
+            5. execute_python_code: Code Interpreterを使用したPythonコード実行
+            6. read_tool_output: 長いために要約されたツール出力の全文を行単位で参照
             
             日本語で丁寧に回答し、必要に応じてツールを使用してください。"""),
             MessagesPlaceholder(variable_name="chat_history"),
@@ -105,47 +223,135 @@ class LangChainCLIAgent:
             prompt=prompt
         )
         
-        return AgentExecutor(
+        return ParallelAgentExecutor(
             agent=agent,
             tools=tools,
-            verbose=True,
+            # 1ステップ内の複数ツール呼び出しを並列実行
+            max_concurrency=int(os.getenv("TOOL_MAX_CONCURRENCY", "4")),
+            # ストリーミング時は逐次表示と混ざらないよう詳細ログを出さない
+            verbose=not self.streaming,
             handle_parsing_errors=True
         )
     
-    def chat(self, user_input: str) -> str:
-        """ユーザー入力に対する応答を生成"""
+    def chat(self, user_input: str, on_event: Optional[EventSink] = None,
+             history: Optional[ChatHistoryManager] = None) -> str:
+        """ユーザー入力に対する応答を生成
+        
+        Args:
+            user_input: ユーザー入力
+            on_event: 指定するとトークンやツール実行をイベントとして逐次受け取る
+            history: 使用するチャット履歴（省略時はこのエージェントの履歴）
+        """
         try:
-            response = self.agent_executor.invoke({
+            self.wait_until_ready()
+            history = history if history is not None else self.history
+            inputs = {
                 "input": user_input,
-                "chat_history": self.chat_history
-            })
+                # 予算を超えていれば古いターンを圧縮してから送信
+                "chat_history": history.get_messages()
+            }
+            if on_event is None:
+                output = self.agent_executor.invoke(inputs)["output"]
+            else:
+                output = self._stream_agent(inputs, on_event)
             
             # レスポンスの整形
-            output = response["output"]
-            if isinstance(output, list) and len(output) > 0:
-                # リスト形式の場合、textの内容のみ抽出
-                if isinstance(output[0], dict) and 'text' in output[0]:
-                    output = output[0]['text']
-                else:
-                    output = str(output)
-            elif not isinstance(output, str):
-                output = str(output)
+            output = _format_output(output)
             
             # チャット履歴に追加
-            self.chat_history.extend([
-                HumanMessage(content=user_input),
-                AIMessage(content=output)
-            ])
+            history.add_turn(user_input, output)
+            
+            return output
+        
+        except Exception as e:
+            error_msg = f"{ERROR_PREFIX}: {str(e)}\n{traceback.format_exc()}"
+            print(f"⚠️ {error_msg}")
+            return error_msg
+    
+    async def achat(self, user_input: str, on_event: Optional[EventSink] = None,
+                    history: Optional[ChatHistoryManager] = None) -> str:
+        """chat()の非同期版（1つのイベントループで多数の会話を並行処理できる）
+        
+        Args:
+            user_input: ユーザー入力
+            on_event: 指定するとトークンやツール実行をイベントとして逐次受け取る
+            history: 使用するチャット履歴（省略時はこのエージェントの履歴）
+        """
+        try:
+            if not self._ready.done():
+                await asyncio.wrap_future(self._ready)
+            self.wait_until_ready()
+            history = history if history is not None else self.history
+            inputs = {
+                "input": user_input,
+                # 要約によるLLM呼び出しでイベントループを止めない
+                "chat_history": await history.aget_messages()
+            }
+            if on_event is None:
+                output = (await self.agent_executor.ainvoke(inputs))["output"]
+            else:
+                output = await self._astream_agent(inputs, on_event)
+            
+            output = _format_output(output)
+            history.add_turn(user_input, output)
             
             return output
         
         except Exception as e:
-            error_msg = f"⚠️ エラーが発生しました: {str(e)}\n{traceback.format_exc()}"
+            error_msg = f"{ERROR_PREFIX}: {str(e)}\n{traceback.format_exc()}"
             print(f"⚠️ {error_msg}")
             return error_msg
     
+    def _stream_agent(self, inputs: dict, on_event: EventSink):
+        """エージェントをストリーミング実行し、最終出力を返す"""
+        from streaming import (TokenStreamHandler, reset_tool_output_sink,
+                               set_tool_output_sink, synchronized)
+        # ツールの出力は別スレッドから届くため、トークンと混ざらないよう直列化する
+        on_event = synchronized(on_event)
+        output = ""
+        config = {"callbacks": [TokenStreamHandler(on_event)]}
+        token = set_tool_output_sink(on_event)
+        try:
+            for chunk in self.agent_executor.stream(inputs, config=config):
+                _emit_step_events(chunk, on_event)
+                if "output" in chunk:
+                    output = chunk["output"]
+        finally:
+            reset_tool_output_sink(token)
+        return output
+    
+    async def _astream_agent(self, inputs: dict, on_event: EventSink):
+        """_stream_agent()の非同期版"""
+        from streaming import (TokenStreamHandler, reset_tool_output_sink,
+                               set_tool_output_sink, synchronized)
+        on_event = synchronized(on_event)
+        output = ""
+        config = {"callbacks": [TokenStreamHandler(on_event)]}
+        token = set_tool_output_sink(on_event)
+        try:
+            async for chunk in self.agent_executor.astream(inputs, config=config):
+                _emit_step_events(chunk, on_event)
+                if "output" in chunk:
+                    output = chunk["output"]
+        finally:
+            reset_tool_output_sink(token)
+        return output
+    
+    def print_cache_stats(self):
+        """LLMキャッシュのヒット率を表示"""
+        if not self._ready.done() or not hasattr(self.llm_cache, "stats"):
+            return
+        stats = self.llm_cache.stats()
+        total = stats["hits"] + stats["misses"]
+        if total:
+            print(f"📦 LLMキャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} "
+                  f"(ヒット率 {stats['hits'] / total:.0%})")
+    
     def run_interactive_session(self):
         """対話型セッションの開始"""
+        from prompt_toolkit import prompt
+        from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+        
         print("🤖 LangChain CLIエージェントにようこそ！")
         print("💡 利用可能なコマンド:")
         print("   - 天気情報: '東京の天気を教えて'")
@@ -182,20 +388,79 @@ class LangChainCLIAgent:
                     continue
                 
                 print("\n🤖 エージェント:")
-                response = self.chat(user_input)
-                print(f"   {response}")
+                if self.streaming:
+                    from streaming import ConsoleStreamPrinter
+                    printer = ConsoleStreamPrinter()
+                    response = self.chat(user_input, on_event=printer)
+                    printer.finish(response)
+                else:
+                    response = self.chat(user_input)
+                    print(f"   {response}")
                 
             except KeyboardInterrupt:
                 print("\n\n👋 セッションを終了します...")
                 break
             except Exception as e:
                 print(f"⚠️ 予期しないエラー: {e}")
+        
+        self.print_cache_stats()
+
+
+# --profile-startup で計測する重いモジュール（インポート順）
+_PROFILED_MODULES = [
+    "prompt_toolkit",
+    "langchain_core",
+    "langchain_anthropic",
+    "langchain.agents",
+    "bedrock_agentcore.tools.code_interpreter_client",
+    "tools",
+]
+
+
+def profile_startup():
+    """起動時間の内訳を表示する"""
+    rows = [("main.py の読み込み", time.perf_counter() - _PROCESS_START)]
+    
+    started = time.perf_counter()
+    agent = LangChainCLIAgent(warm_up=False, background_init=True)
+    rows.append(("プロンプト表示までの準備", time.perf_counter() - started))
+    
+    # バックグラウンド初期化の完了を待ってから各モジュールの単独コストを計測する
+    init_started = time.perf_counter()
+    agent.wait_until_ready()
+    rows.append(("バックグラウンド初期化（待ち時間）", time.perf_counter() - init_started))
+    
+    print("\n⏱️ 起動時間の内訳:")
+    for label, seconds in rows:
+        print(f"   {label:<36} {seconds * 1000:8.1f} ms")
+    
+    print("\n📦 モジュール別インポート時間（未読み込み時の単独計測）:")
+    code = "import importlib,time;t=time.perf_counter();importlib.import_module({!r});" \
+           "print(time.perf_counter()-t)"
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in _PROFILED_MODULES:
+        result = subprocess.run([sys.executable, "-c", code.format(name)],
+                                capture_output=True, text=True, cwd=src_dir)
+        try:
+            print(f"   {name:<48} {float(result.stdout.strip().splitlines()[-1]) * 1000:8.1f} ms")
+        except (ValueError, IndexError):
+            print(f"   {name:<48} 計測失敗")
 
 
 def main():
     """メイン関数"""
+    parser = argparse.ArgumentParser(description="LangChain CLIエージェント")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="起動時間とモジュール別インポート時間を表示して終了")
+    args = parser.parse_args()
+    
+    if args.profile_startup:
+        profile_startup()
+        return
+    
     try:
-        agent = LangChainCLIAgent()
+        # LLMやツールはバックグラウンドで準備し、すぐにプロンプトを表示する
+        agent = LangChainCLIAgent(background_init=True)
         agent.run_interactive_session()
     except Exception as e:
         print(f"❌ エージェントの初期化に失敗しました: {e}")
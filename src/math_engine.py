@@ -0,0 +1,410 @@
+"""数式の評価エンジン
+
+数式を一度だけ構文解析し、許可したノードだけからなるASTであることを確認してから
+コンパイルする。コンパイル済みのコードは数式の文字列をキーにLRUキャッシュし、
+モジュールレベルで用意した名前空間に対して評価する。
+属性アクセス・添字・内包表記・ラムダなどは構文の段階で拒否するため、
+組み込み関数やオブジェクトの内部に辿り着く経路がない。
+
+巨大な整数や長大なリストを作る演算（累乗・乗算・階乗・組合せなど）は、結果の大きさを
+計算前に見積もるガード関数に置き換えて評価するため、1つの数式がCPUやメモリを
+占有してプロセス全体（対話CLIやサーバー）を止めることはない。
+
+evaluate_batch() は変数の範囲（直積）に対して同じ数式をまとめて評価する。
+NumPyがあれば配列に対して1回だけ評価し、ベクトル化できない数式（条件式や
+NumPyに対応する関数が無い場合）やNumPyが無い環境では1点ずつ評価する。
+"""
+import ast
+import itertools
+import keyword
+import math
+from functools import lru_cache, reduce
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# 整数の結果の上限ビット数（10進数で約3000桁）
+MAX_INT_BITS = 10_000
+# 結果を文字列にしたときの上限文字数
+MAX_RESULT_CHARS = 1000
+# 数式の上限文字数
+MAX_EXPRESSION_CHARS = 2000
+# round() の桁数の上限
+MAX_ROUND_DIGITS = 1000
+
+
+class ExpressionError(ValueError):
+    """数式が不正、または許可されていない構文を含む"""
+
+
+class ResourceLimitError(ExpressionError):
+    """計算結果が大きすぎるなど、資源の上限を超える"""
+
+
+def _check_int_bits(bits: float):
+    if bits > MAX_INT_BITS:
+        raise ResourceLimitError(f"結果の整数が大きすぎます（約{int(bits)}ビット、上限{MAX_INT_BITS}ビット）")
+
+
+def _safe_pow(base, exp, mod=None):
+    """累乗（整数の結果が上限を超える場合は計算せずにエラー）"""
+    if mod is not None:
+        # 剰余付きの累乗は結果がmod未満に収まる
+        return pow(base, exp, mod)
+    if isinstance(base, int) and isinstance(exp, int) and exp > 0 and abs(base) > 1:
+        _check_int_bits(exp * math.log2(abs(base)))
+    return base ** exp
+
+
+def _safe_mul(left, right):
+    """乗算（整数の桁数とリストの繰り返しを制限）"""
+    if isinstance(left, (list, tuple)) or isinstance(right, (list, tuple)):
+        raise ResourceLimitError("リストの繰り返しは使用できません")
+    if isinstance(left, int) and isinstance(right, int):
+        _check_int_bits(left.bit_length() + right.bit_length())
+    return left * right
+
+
+def _log2_factorial(n: int) -> float:
+    return math.lgamma(n + 1) / math.log(2)
+
+
+def _safe_factorial(n):
+    """階乗（結果のビット数を事前に見積もる）"""
+    if isinstance(n, int) and n > 1:
+        _check_int_bits(_log2_factorial(n))
+    return math.factorial(n)
+
+
+def _safe_comb(n, k):
+    """組合せの数（結果のビット数を事前に見積もる）"""
+    if isinstance(n, int) and isinstance(k, int) and 0 <= k <= n:
+        _check_int_bits(_log2_factorial(n) - _log2_factorial(k) - _log2_factorial(n - k))
+    return math.comb(n, k)
+
+
+def _safe_perm(n, k=None):
+    """順列の数（結果のビット数を事前に見積もる）"""
+    if isinstance(n, int) and (k is None or isinstance(k, int)):
+        k_ = n if k is None else k
+        if 0 <= k_ <= n:
+            _check_int_bits(_log2_factorial(n) - _log2_factorial(n - k_))
+    return math.perm(n, k)
+
+
+def _safe_round(number, ndigits=None):
+    """丸め（極端な桁数は巨大な10の累乗の計算になるため制限）"""
+    if ndigits is not None and abs(ndigits) > MAX_ROUND_DIGITS:
+        raise ResourceLimitError(f"丸める桁数が大きすぎます（上限{MAX_ROUND_DIGITS}桁）")
+    return round(number, ndigits)
+
+
+# 数式から使える名前（mathモジュールの関数・定数と一部の組み込み関数）
+NAMESPACE: Dict[str, object] = {
+    k: v for k, v in math.__dict__.items() if not k.startswith("_")
+}
+NAMESPACE.update({
+    "abs": abs,
+    "round": _safe_round,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "pow": _safe_pow,
+    "factorial": _safe_factorial,
+    "comb": _safe_comb,
+    "perm": _safe_perm,
+})
+
+# 演算子を置き換えるガード関数（数式からは直接呼べない）
+_GUARDS: Dict[str, object] = {"_safe_pow": _safe_pow, "_safe_mul": _safe_mul}
+_GUARDED_OPERATORS = {ast.Pow: "_safe_pow", ast.Mult: "_safe_mul"}
+
+# 評価時のグローバル名前空間（組み込み関数は一切見せない）
+_GLOBALS: Dict[str, object] = {**NAMESPACE, **_GUARDS, "__builtins__": {}}
+
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.Constant, ast.Name, ast.Load, ast.Tuple, ast.List,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UnaryOp, ast.UAdd, ast.USub, ast.Not,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.IfExp, ast.Call, ast.keyword,
+)
+
+CACHE_SIZE = 1024
+
+# evaluate_batch() で評価する点の数の上限
+MAX_BATCH_POINTS = 1_000_000
+
+# NumPyのユニバーサル関数に置き換えて配列のまま評価できる関数（名前が異なるものは対応付ける）
+_VECTOR_FUNCTIONS = {
+    name: name for name in (
+        "sin", "cos", "tan", "sinh", "cosh", "tanh", "exp", "exp2", "expm1",
+        "log10", "log2", "log1p", "sqrt", "cbrt", "floor", "ceil", "trunc",
+        "hypot", "degrees", "radians", "copysign", "fmod", "isnan", "isinf", "isfinite",
+    )
+}
+_VECTOR_FUNCTIONS.update({
+    "asin": "arcsin", "acos": "arccos", "atan": "arctan", "atan2": "arctan2",
+    "asinh": "arcsinh", "acosh": "arccosh", "atanh": "arctanh",
+    "fabs": "abs", "abs": "abs", "pow": "power", "round": "round",
+})
+
+_VECTOR_GLOBALS: Optional[Dict[str, object]] = None
+
+
+class _Validator(ast.NodeVisitor):
+    def __init__(self, variables: Tuple[str, ...]):
+        self.variables = variables
+
+    def generic_visit(self, node: ast.AST):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ExpressionError(f"使用できない構文です: {type(node).__name__}")
+        super().generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant):
+        if not isinstance(node.value, (int, float, complex)):
+            raise ExpressionError(f"数値以外の定数は使用できません: {node.value!r}")
+
+    def visit_Name(self, node: ast.Name):
+        if node.id not in NAMESPACE and node.id not in self.variables:
+            raise ExpressionError(f"未定義の名前です: {node.id}")
+
+    def visit_Call(self, node: ast.Call):
+        # 呼び出せるのは名前空間の関数だけ（変数や式の結果は呼び出せない）
+        if not isinstance(node.func, ast.Name) or not callable(NAMESPACE.get(node.func.id)):
+            raise ExpressionError("呼び出せるのは用意された関数だけです")
+        self.generic_visit(node)
+
+
+class _Guard(ast.NodeTransformer):
+    """累乗・乗算の演算子をガード関数の呼び出しに置き換える"""
+
+    def visit_BinOp(self, node: ast.BinOp):
+        self.generic_visit(node)
+        guard = _GUARDED_OPERATORS.get(type(node.op))
+        if guard is None:
+            return node
+        call = ast.Call(func=ast.Name(id=guard, ctx=ast.Load()),
+                        args=[node.left, node.right], keywords=[])
+        return ast.copy_location(call, node)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(expression: str, variables: Tuple[str, ...] = ()):
+    """数式を検証してコンパイルする（結果はキャッシュされる）
+
+    Args:
+        expression: 数式
+        variables: 数式中で使える変数名
+    """
+    if len(expression) > MAX_EXPRESSION_CHARS:
+        raise ExpressionError(f"数式が長すぎます（上限{MAX_EXPRESSION_CHARS}文字）")
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"数式の構文が正しくありません: {e.msg}") from e
+    try:
+        _Validator(variables).visit(tree)
+        tree = ast.fix_missing_locations(_Guard().visit(tree))
+        return compile(tree, "<expression>", "eval")
+    except RecursionError as e:
+        raise ExpressionError("数式の入れ子が深すぎます") from e
+
+
+def format_result(value) -> str:
+    """計算結果を文字列にする（上限文字数を超える部分は省略）"""
+    text = str(value)
+    if len(text) > MAX_RESULT_CHARS:
+        return f"{text[:MAX_RESULT_CHARS]}…（全{len(text)}文字のうち先頭{MAX_RESULT_CHARS}文字）"
+    return text
+
+
+def evaluate(expression: str, variables: Optional[Mapping[str, object]] = None):
+    """数式を評価して結果を返す
+
+    Args:
+        expression: 数式
+        variables: 数式中の変数の値
+    """
+    if not variables:
+        return eval(compile_expression(expression), _GLOBALS)
+    code = compile_expression(expression, tuple(sorted(variables)))
+    return eval(code, _GLOBALS, dict(variables))
+
+
+# ----------------------------------------------------------------------
+# 一括評価
+# ----------------------------------------------------------------------
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _vector_globals(np) -> Dict[str, object]:
+    """配列に対して評価するためのグローバル名前空間（初回に作成）"""
+    global _VECTOR_GLOBALS
+    if _VECTOR_GLOBALS is None:
+        namespace: Dict[str, object] = {
+            k: v for k, v in NAMESPACE.items() if isinstance(v, float)
+        }
+        for name, np_name in _VECTOR_FUNCTIONS.items():
+            if name in NAMESPACE and hasattr(np, np_name):
+                namespace[name] = getattr(np, np_name)
+
+        def log(x, base=None):
+            return np.log(x) if base is None else np.log(x) / np.log(base)
+
+        def vmin(*args):
+            return np.min(args[0]) if len(args) == 1 else reduce(np.minimum, args)
+
+        def vmax(*args):
+            return np.max(args[0]) if len(args) == 1 else reduce(np.maximum, args)
+
+        # 組み込みのsumはリスト内の配列を要素ごとに足すのでそのまま使える
+        namespace.update({"log": log, "min": vmin, "max": vmax, "sum": sum,
+                          **_GUARDS, "__builtins__": {}})
+        _VECTOR_GLOBALS = namespace
+    return _VECTOR_GLOBALS
+
+
+def make_range(start: float, stop: float, step: float = 1.0) -> List[float]:
+    """start から stop まで（stopを含む）step 刻みの値のリストを作成"""
+    if step == 0 or (stop - start) * step < 0:
+        raise ExpressionError(f"範囲が正しくありません: start={start}, stop={stop}, step={step}")
+    # 誤差の蓄積を避けるため、足し合わせずに i*step で求める
+    count = int(math.floor((stop - start) / step + 1e-9)) + 1
+    if count > MAX_BATCH_POINTS:
+        raise ExpressionError(f"点の数が多すぎます（{count}点、上限{MAX_BATCH_POINTS}点）")
+    return [start + i * step for i in range(count)]
+
+
+class BatchResult:
+    """一括評価の結果
+
+    Attributes:
+        names: 変数名
+        axes: 変数ごとの値（結果は axes の直積を先頭の変数から順に並べたもの）
+        values: 各点の評価結果（評価できなかった点はnan）
+        vectorized: NumPyで配列として評価したかどうか
+    """
+
+    def __init__(self, names: List[str], axes: List[List[float]],
+                 values: List[float], vectorized: bool):
+        self.names = names
+        self.axes = axes
+        self.values = values
+        self.vectorized = vectorized
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def point(self, index: int) -> Dict[str, float]:
+        """index番目の点の変数の値"""
+        point = {}
+        for name, axis in zip(reversed(self.names), reversed(self.axes)):
+            index, i = divmod(index, len(axis))
+            point[name] = axis[i]
+        return {name: point[name] for name in self.names}
+
+
+def evaluate_batch(expression: str, variables: Mapping[str, Sequence[float]]) -> BatchResult:
+    """変数の値の直積の各点で数式を評価する
+
+    Args:
+        expression: 数式
+        variables: 変数名と値の列（make_range()で作成した範囲など）
+    """
+    names = list(variables)
+    for name in names:
+        if not name.isidentifier() or keyword.iskeyword(name):
+            raise ExpressionError(f"変数名が正しくありません: {name}")
+    axes = [[float(v) for v in variables[name]] for name in names]
+    if any(not axis for axis in axes):
+        raise ExpressionError("値が空の変数があります")
+    total = math.prod(len(axis) for axis in axes)
+    if total > MAX_BATCH_POINTS:
+        raise ExpressionError(f"点の数が多すぎます（{total}点、上限{MAX_BATCH_POINTS}点）")
+    code = compile_expression(expression, tuple(sorted(names)))
+
+    np = _import_numpy()
+    if np is not None:
+        values = _evaluate_vectorized(np, code, names, axes, total)
+        if values is not None:
+            return BatchResult(names, axes, values, vectorized=True)
+
+    # factorialやcombなど整数を要求する関数のため、整数値はintとして渡す
+    scalar_axes = [[int(v) if v.is_integer() and abs(v) < 2 ** 53 else v for v in axis]
+                   for axis in axes]
+    values = []
+    for point in itertools.product(*scalar_axes):
+        try:
+            value = eval(code, _GLOBALS, dict(zip(names, point)))
+            values.append(float(value))
+        except (ArithmeticError, ValueError, TypeError):
+            values.append(math.nan)
+    return BatchResult(names, axes, values, vectorized=False)
+
+
+def _evaluate_vectorized(np, code, names: List[str], axes: List[List[float]],
+                         total: int) -> Optional[List[float]]:
+    """配列として評価する（ベクトル化できない数式の場合はNone）"""
+    grids = np.meshgrid(*[np.asarray(axis, dtype=float) for axis in axes], indexing="ij")
+    local_vars = {name: grid.ravel() for name, grid in zip(names, grids)}
+    try:
+        with np.errstate(all="ignore"):
+            result = eval(code, _vector_globals(np), local_vars)
+            values = np.broadcast_to(np.asarray(result, dtype=float), (total,))
+    except Exception:
+        # 条件式の真偽判定やNumPyに無い関数などは1点ずつの評価に任せる
+        return None
+    # 無限大は計算結果として残し、定義域外などで生じたnanは評価できなかった点として扱う
+    return values.tolist()
+
+
+def summarize_batch(result: BatchResult, max_rows: int = 20) -> str:
+    """一括評価の結果を統計値と抜粋した表にまとめる"""
+    finite = [(v, i) for i, v in enumerate(result.values) if math.isfinite(v)]
+    failed = sum(1 for v in result.values if math.isnan(v))
+
+    def fmt_point(index: int) -> str:
+        return ", ".join(f"{k}={_fmt(v)}" for k, v in result.point(index).items())
+
+    method = "ベクトル演算" if result.vectorized else "逐次計算"
+    lines = [f"{len(result)}点を評価しました（{method}）"]
+    if finite:
+        low, low_i = min(finite)
+        high, high_i = max(finite)
+        mean = math.fsum(v for v, _ in finite) / len(finite)
+        lines.append(f"最小値: {_fmt(low)} （{fmt_point(low_i)}）")
+        lines.append(f"最大値: {_fmt(high)} （{fmt_point(high_i)}）")
+        lines.append(f"平均: {_fmt(mean)}")
+    if failed:
+        lines.append(f"計算できなかった点: {failed}点")
+    if len(finite) + failed < len(result):
+        lines.append(f"無限大になった点: {len(result) - len(finite) - failed}点")
+
+    rows = _sample_indices(len(result), max_rows)
+    header = " | ".join(result.names + ["値"])
+    title = "表:" if len(rows) == len(result) else f"表（{len(rows)}行を等間隔に抜粋）:"
+    lines.extend(["", title, header])
+    for index in rows:
+        cells = [_fmt(v) for v in result.point(index).values()] + [_fmt(result.values[index])]
+        lines.append(" | ".join(cells))
+    return "\n".join(lines)
+
+
+def _sample_indices(total: int, count: int) -> List[int]:
+    """先頭と末尾を含む等間隔の添字"""
+    if total <= count:
+        return list(range(total))
+    if count <= 1:
+        return [0]
+    return sorted({round(i * (total - 1) / (count - 1)) for i in range(count)})
+
+
+def _fmt(value: float) -> str:
+    # -0.0 は 0 と表示する
+    return f"{value + 0.0:.10g}"
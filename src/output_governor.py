@@ -0,0 +1,233 @@
+"""ツール結果の大きさを制限してLLMに渡すための出力ガバナー
+
+Python実行結果などの長い出力をそのままエージェントに返すと、次のプロンプトの
+トークン数と応答時間が膨らむ。OutputGovernorは上限を超えた出力を
+    - 表形式の出力: 行数・列数・列ごとの統計値と先頭・末尾の行に要約
+    - それ以外:     先頭と末尾を残して中間を省略
+した上で返し、全文はアーティファクトとして保存する。エージェントは必要なときだけ
+アーティファクトIDを指定して続きを読める。
+"""
+import collections
+import math
+import os
+import re
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+from chat_history import estimate_tokens
+
+# pandasのDataFrame表示の末尾（例: "[1000 rows x 5 columns]"）
+_PANDAS_SHAPE = re.compile(r"^\[(\d+) rows x (\d+) columns\]$")
+_ARTIFACT_ID = re.compile(r"^[0-9a-f]{12}$")
+
+
+class ArtifactStore:
+    """ツール出力の全文をファイルとして保存する（古いものから削除）
+
+    Args:
+        directory: 保存先ディレクトリ
+        max_artifacts: 保持する最大件数
+    """
+
+    def __init__(self, directory: str = ".tool_outputs", max_artifacts: int = 100):
+        self.directory = directory
+        self.max_artifacts = max_artifacts
+        self._ids: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, text: str) -> str:
+        """全文を保存してアーティファクトIDを返す"""
+        artifact_id = uuid.uuid4().hex[:12]
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(artifact_id), "w", encoding="utf-8") as f:
+            f.write(text)
+        with self._lock:
+            self._ids[artifact_id] = None
+            expired = []
+            while len(self._ids) > self.max_artifacts:
+                expired.append(self._ids.popitem(last=False)[0])
+        for old_id in expired:
+            try:
+                os.remove(self._path(old_id))
+            except OSError:
+                pass
+        return artifact_id
+
+    def load(self, artifact_id: str) -> Optional[str]:
+        """保存した全文を読み込む（見つからない場合はNone）"""
+        if not _ARTIFACT_ID.match(artifact_id):
+            return None
+        try:
+            with open(self._path(artifact_id), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _path(self, artifact_id: str) -> str:
+        return os.path.join(self.directory, f"{artifact_id}.txt")
+
+
+class OutputGovernor:
+    """ツール出力を文字数・トークン数の上限に収める
+
+    Args:
+        max_chars: LLMに返す最大文字数
+        max_tokens: LLMに返す最大の推定トークン数
+        store: 上限を超えた出力の全文を保存するアーティファクトストア（Noneなら保存しない）
+        preview_rows: 表形式の出力で残す先頭・末尾の行数
+    """
+
+    def __init__(self, max_chars: int = 4000, max_tokens: int = 2000,
+                 store: Optional[ArtifactStore] = None, preview_rows: int = 5):
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.store = store
+        self.preview_rows = preview_rows
+
+    def budget(self, text: str) -> int:
+        """textをLLMに返せる文字数（上限内なら全長）"""
+        budget = min(len(text), self.max_chars)
+        tokens = estimate_tokens(text)
+        if tokens > self.max_tokens:
+            # 文字あたりのトークン数から上限に収まる文字数を見積もる
+            budget = min(budget, int(len(text) * self.max_tokens / tokens))
+        return budget
+
+    def govern(self, text: str) -> str:
+        """上限を超える出力を要約・省略し、全文の参照方法を添えて返す"""
+        budget = self.budget(text)
+        if budget >= len(text):
+            return text
+
+        summary = summarize_table(text, self.preview_rows)
+        if summary is None or len(summary) > budget:
+            summary = truncate_middle(text, budget)
+        if self.store is None:
+            return summary
+        artifact_id = self.store.save(text)
+        total_lines = text.count("\n") + 1
+        return (f"{summary}\n\n[出力が長いため要約しました（全{total_lines}行・{len(text)}文字）。"
+                f"全文はアーティファクト {artifact_id} に保存しました。"
+                f"read_tool_output で行を指定して参照できます]")
+
+    def page(self, artifact_id: str, start_line: int = 1, num_lines: int = 100) -> Optional[str]:
+        """保存した全文の一部を行単位で返す（見つからない場合はNone）"""
+        text = self.store.load(artifact_id) if self.store is not None else None
+        if text is None:
+            return None
+        lines = text.splitlines()
+        start = max(1, start_line)
+        selected = lines[start - 1:start - 1 + max(1, num_lines)]
+        body = "\n".join(selected)
+        budget = self.budget(body)
+        partial = False
+        if budget < len(body):
+            # 1ページも上限に収める（収まった行までで区切り、1行も収まらなければ行の途中で切る）
+            if "\n" in body[:budget]:
+                body = body[:budget].rsplit("\n", 1)[0]
+            else:
+                body, partial = body[:budget], True
+            selected = body.split("\n")
+        end = start + len(selected) - 1
+        footer = f"[{start}〜{end}行目 / 全{len(lines)}行"
+        if partial:
+            footer += f"。{end}行目は先頭{len(body)}文字のみ"
+        if end < len(lines):
+            footer += f"。続きは start_line={end + 1}"
+        return f"{body}\n{footer}]"
+
+
+def truncate_middle(text: str, budget: int, head_ratio: float = 0.6) -> str:
+    """先頭と末尾を残し、中間を省略する（行の途中では切らない）"""
+    marker_reserve = 60
+    head_budget = max(0, int((budget - marker_reserve) * head_ratio))
+    tail_budget = max(0, budget - marker_reserve - head_budget)
+    head = text[:head_budget]
+    if "\n" in head:
+        head = head[:head.rindex("\n")]
+    tail = text[len(text) - tail_budget:] if tail_budget else ""
+    if "\n" in tail:
+        tail = tail[tail.index("\n") + 1:]
+    omitted = text[len(head):len(text) - len(tail)]
+    marker = f"\n... （{omitted.count(chr(10))}行・{len(omitted)}文字を省略） ...\n"
+    return f"{head}{marker}{tail}"
+
+
+def summarize_table(text: str, preview_rows: int = 5) -> Optional[str]:
+    """表形式の出力（CSV・TSV・pandasの表示など）を要約する。表でなければNone"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    shape = None
+    if lines and _PANDAS_SHAPE.match(lines[-1].strip()):
+        match = _PANDAS_SHAPE.match(lines[-1].strip())
+        shape = (int(match.group(1)), int(match.group(2)))
+        lines = lines[:-1]
+    if len(lines) < 2 * preview_rows + 2:
+        return None
+
+    parsed = _parse_table(lines)
+    if parsed is None:
+        return None
+    header, rows, row_lines = parsed
+    # pandasの表示は見出し行にインデックス列が無いため1列ずれる
+    offset = len(rows[0]) - len(header) if len(header) < len(rows[0]) else 0
+    n_rows = shape[0] if shape else len(rows)
+    n_cols = shape[1] if shape else len(header)
+
+    out = [f"表形式の出力: {n_rows}行 × {n_cols}列"]
+    if shape and shape[0] > len(rows):
+        out[0] += f"（表示されているのは{len(rows)}行）"
+    out.append(f"列: {', '.join(header[:30])}" + (" ..." if len(header) > 30 else ""))
+
+    stats = []
+    for j, name in enumerate(header[:20]):
+        values = _numeric_column(rows, j + offset)
+        if values:
+            stats.append(f"  {name}: 最小 {min(values):.6g} / 最大 {max(values):.6g} / "
+                         f"平均 {math.fsum(values) / len(values):.6g}")
+    if stats:
+        out.append("数値列の統計:")
+        out.extend(stats)
+
+    out.append(f"先頭{preview_rows}行:")
+    out.append(lines[0])
+    out.extend(row_lines[:preview_rows])
+    out.append(f"末尾{preview_rows}行:")
+    out.extend(row_lines[-preview_rows:])
+    return "\n".join(out)
+
+
+def _split(line: str, delimiter: Optional[str]) -> List[str]:
+    if delimiter is None:
+        return line.split()
+    return [cell.strip() for cell in line.strip().strip("|").split(delimiter)]
+
+
+def _parse_table(lines: List[str]) -> Optional[Tuple[List[str], List[List[str]], List[str]]]:
+    """見出し行と、列数のそろった行が9割以上ある区切り方を探す"""
+    body = lines[1:]
+    for delimiter in (",", "\t", "|", None):
+        counts = collections.Counter(len(_split(line, delimiter)) for line in body)
+        columns, matched = counts.most_common(1)[0]
+        if columns < 2 or matched < 0.9 * len(body):
+            continue
+        row_lines = [line for line in body if len(_split(line, delimiter)) == columns]
+        header = _split(lines[0], delimiter)
+        if not (columns - 1 <= len(header) <= columns):
+            continue
+        return header, [_split(line, delimiter) for line in row_lines], row_lines
+    return None
+
+
+def _numeric_column(rows: List[List[str]], index: int) -> Optional[List[float]]:
+    values = []
+    for row in rows:
+        if index >= len(row):
+            return None
+        try:
+            value = float(row[index])
+        except ValueError:
+            return None
+        if math.isfinite(value):
+            values.append(value)
+    return values or None
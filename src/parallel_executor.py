@@ -0,0 +1,71 @@
+"""1ステップ内の独立したツール呼び出しを並列実行するAgentExecutor
+
+Claudeが1ターンで複数のツール呼び出しを返した場合、標準のAgentExecutorは
+同期実行時に1つずつ順番に実行する。ParallelAgentExecutorはそれらを
+スレッドプールで同時に実行し、ステップの所要時間を各ツールの最大値に近づける。
+"""
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator, Optional
+
+from langchain.agents import AgentExecutor
+from pydantic import Field, PrivateAttr
+
+# 現在のステップのツール呼び出しを受け付けるスレッドプール（同期実行時）
+_STEP_EXECUTOR: contextvars.ContextVar[Optional[ThreadPoolExecutor]] = contextvars.ContextVar(
+    "parallel_agent_step_executor", default=None
+)
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """ツール呼び出しを並列実行するAgentExecutor"""
+
+    max_concurrency: int = Field(default=4, ge=1)
+    """1ステップで同時に実行するツール呼び出しの上限"""
+
+    _semaphores: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+
+    def _iter_next_step(self, *args: Any, **kwargs: Any) -> Iterator[Any]:
+        if self.max_concurrency <= 1:
+            yield from super()._iter_next_step(*args, **kwargs)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="agent-tool"
+        ) as executor:
+            token = _STEP_EXECUTOR.set(executor)
+            try:
+                # 各ツール呼び出しはFutureとして投入されるため、ここで全件が同時に走り出す
+                items = list(super()._iter_next_step(*args, **kwargs))
+            finally:
+                _STEP_EXECUTOR.reset(token)
+            for item in items:
+                yield item.result() if isinstance(item, Future) else item
+
+    def _perform_agent_action(self, *args: Any, **kwargs: Any) -> Any:
+        executor = _STEP_EXECUTOR.get()
+        if executor is None:
+            return super()._perform_agent_action(*args, **kwargs)
+        # セッションキーなどのコンテキスト変数をワーカースレッドに引き継ぐ
+        context = contextvars.copy_context()
+        return executor.submit(context.run, super()._perform_agent_action, *args, **kwargs)
+
+    async def _aperform_agent_action(
+        self, name_to_tool_map, color_mapping, agent_action, run_manager=None
+    ) -> Any:
+        # 非同期版は標準でasyncio.gatherされるため、同時実行数だけを制限する
+        if run_manager is None:
+            return await super()._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+        semaphore = self._semaphores.get(run_manager)
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(
+                run_manager, asyncio.Semaphore(self.max_concurrency)
+            )
+        async with semaphore:
+            return await super()._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
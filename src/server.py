@@ -0,0 +1,213 @@
+"""LangChainエージェントのHTTPサーバーモード
+
+1つのプロセスで複数の会話セッションをホストする。LLMクライアント・ツール・
+Code Interpreterプールは全セッションで共有し、チャット履歴だけをセッションごとに持つ。
+
+エンドポイント:
+    GET    /health                    ヘルスチェック
+    POST   /sessions                  セッション作成 -> {"session_id": ...}
+    POST   /sessions/{id}/chat        {"input": "...", "stream": false}
+                                      stream=trueの場合はServer-Sent Eventsで逐次返す
+    DELETE /sessions/{id}             セッション削除
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from chat_history import ChatHistoryManager
+from code_interpreter_pool import set_session_key
+from main import LangChainCLIAgent
+
+
+class ChatSession:
+    """1つの会話セッション"""
+
+    def __init__(self, session_id: str, history: ChatHistoryManager):
+        self.session_id = session_id
+        self.history = history
+        self.last_used = time.monotonic()
+        # 同じ会話のターンは順番に処理する
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+    """セッションの管理（一定時間使われないセッションは破棄する）
+
+    Args:
+        agent: 全セッションで共有するエージェント
+        idle_timeout: セッションを破棄するまでのアイドル秒数
+    """
+
+    def __init__(self, agent: LangChainCLIAgent, idle_timeout: float = 3600.0):
+        self.agent = agent
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> ChatSession:
+        """新しいセッションを作成"""
+        session = ChatSession(uuid.uuid4().hex, self.agent.create_history())
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """セッションを取得"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        """セッションを削除"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [sid for sid, s in self._sessions.items()
+                   if now - s.last_used > self.idle_timeout and not s.lock.locked()]
+        for sid in expired:
+            del self._sessions[sid]
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """エージェントAPIのリクエストハンドラ"""
+
+    server_version = "LangChainAgentServer/0.1"
+    store: SessionStore
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "ok", "sessions": len(self.store)})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["sessions"]:
+            session = self.store.create()
+            self._send_json(HTTPStatus.CREATED, {"session_id": session.session_id})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "chat":
+            self._handle_chat(parts[1])
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_DELETE(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "sessions" and self.store.delete(parts[1]):
+            self._send_json(HTTPStatus.OK, {"deleted": parts[1]})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "session not found"})
+
+    def _handle_chat(self, session_id: str):
+        session = self.store.get(session_id)
+        if session is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "session not found"})
+            return
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        user_input = body.get("input")
+        if not isinstance(user_input, str) or not user_input.strip():
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "input is required"})
+            return
+
+        # Code Interpreterのサンドボックスはセッションごとに割り当てる
+        set_session_key(session.session_id)
+        with session.lock:
+            if body.get("stream"):
+                self._stream_chat(session, user_input)
+            else:
+                output = self.store.agent.chat(user_input, history=session.history)
+                self._send_json(HTTPStatus.OK, {"output": output})
+
+    def _stream_chat(self, session: ChatSession, user_input: str):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        disconnected = False
+
+        def send_event(event: dict):
+            nonlocal disconnected
+            if disconnected:
+                return
+            data = json.dumps(event, ensure_ascii=False, default=str)
+            try:
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントが切断しても会話は最後まで処理して履歴に残す
+                disconnected = True
+
+        output = self.store.agent.chat(user_input, on_event=send_event, history=session.history)
+        send_event({"type": "final", "output": output})
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON: {e}") from e
+        if not isinstance(body, dict):
+            raise ValueError("JSON object expected")
+        return body
+
+    def _send_json(self, status: HTTPStatus, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_server(host: str, port: int, agent: Optional[LangChainCLIAgent] = None,
+                  idle_timeout: float = 3600.0) -> ThreadingHTTPServer:
+    """エージェントを共有するHTTPサーバーを作成"""
+    store = SessionStore(agent or LangChainCLIAgent(), idle_timeout=idle_timeout)
+    handler = type("BoundAgentRequestHandler", (AgentRequestHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """サーバーのエントリーポイント"""
+    parser = argparse.ArgumentParser(description="LangChainエージェントのHTTPサーバー")
+    parser.add_argument("--host", default=os.getenv("AGENT_SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AGENT_SERVER_PORT", "8000")))
+    parser.add_argument("--session-idle-timeout", type=float,
+                        default=float(os.getenv("AGENT_SESSION_IDLE_TIMEOUT", "3600")))
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, idle_timeout=args.session_idle_timeout)
+    print(f"🌐 エージェントサーバーを起動しました: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 サーバーを停止します...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""エージェント実行中のストリーミングイベント
+
+イベントは {"type": ..., ...} 形式の辞書で、以下の種類がある:
+    token:      モデルが生成したテキスト断片（"text"）
+    tool_start: ツール呼び出しの開始（"tool", "input"）
+    tool_output: 実行中のツールの出力の断片（"tool", "stream"="stdout"|"stderr", "text"）
+    tool_end:   ツール呼び出しの完了（"tool", "output"）
+"""
+import contextvars
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+StreamEvent = Dict[str, Any]
+EventSink = Callable[[StreamEvent], None]
+
+# 実行中のツールが出力を転送する先（ツールはコンテキスト変数経由で受け取る）
+_TOOL_OUTPUT_SINK: contextvars.ContextVar[Optional[EventSink]] = contextvars.ContextVar(
+    "tool_output_sink", default=None
+)
+
+
+def set_tool_output_sink(sink: Optional[EventSink]) -> contextvars.Token:
+    """現在のコンテキストで実行されるツールの出力の転送先を設定"""
+    return _TOOL_OUTPUT_SINK.set(sink)
+
+
+def reset_tool_output_sink(token: contextvars.Token):
+    """set_tool_output_sink()の設定を元に戻す"""
+    _TOOL_OUTPUT_SINK.reset(token)
+
+
+def emit_tool_output(tool: str, stream: str, text: str):
+    """ツールの出力の断片を転送する（転送先が無ければ何もしない）"""
+    sink = _TOOL_OUTPUT_SINK.get()
+    if sink is not None and text:
+        sink({"type": "tool_output", "tool": tool, "stream": stream, "text": text})
+
+
+def synchronized(sink: EventSink) -> EventSink:
+    """複数のスレッドから呼ばれても1件ずつ順に渡すイベント転送先にする"""
+    lock = threading.Lock()
+
+    def locked_sink(event: StreamEvent) -> None:
+        with lock:
+            sink(event)
+    return locked_sink
+
+
+def _token_text(token: Any) -> str:
+    """トークン（文字列またはAnthropicのコンテンツブロック）からテキストを取り出す"""
+    if isinstance(token, str):
+        return token
+    if isinstance(token, list):
+        return "".join(
+            block.get("text", "") for block in token
+            if isinstance(block, dict) and block.get("type", "text") == "text"
+        )
+    return ""
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """LLMのトークンをイベントとして転送するコールバックハンドラ"""
+
+    # 非同期実行時も別スレッドに回さず順序どおりに転送する
+    run_inline = True
+
+    def __init__(self, sink: EventSink):
+        self.sink = sink
+
+    def on_llm_new_token(self, token: Any, **kwargs: Any) -> None:
+        text = _token_text(token)
+        if not text:
+            chunk = kwargs.get("chunk")
+            message = getattr(chunk, "message", None)
+            text = _token_text(getattr(message, "content", ""))
+        if text:
+            self.sink({"type": "token", "text": text})
+
+
+class ConsoleStreamPrinter:
+    """ストリーミングイベントをターミナルに逐次表示する
+
+    Args:
+        max_tool_output: ツール結果を表示する最大文字数
+    """
+
+    def __init__(self, max_tool_output: int = 200, stream=None):
+        self.max_tool_output = max_tool_output
+        self.stream = stream or sys.stdout
+        self.printed_text = False
+        self._at_line_start = True
+
+    def __call__(self, event: StreamEvent) -> None:
+        kind = event.get("type")
+        if kind == "token":
+            if self._at_line_start:
+                self._write("   ")
+            self._write(event["text"])
+            self._at_line_start = event["text"].endswith("\n")
+            self.printed_text = True
+        elif kind == "tool_start":
+            self._newline()
+            self._write(f"   🔧 {event['tool']} を実行中... 入力: {event.get('input')}\n")
+        elif kind == "tool_output":
+            for line in event.get("text", "").splitlines(keepends=True):
+                if self._at_line_start:
+                    self._write("   │ ")
+                self._write(line)
+                self._at_line_start = line.endswith("\n")
+        elif kind == "tool_end":
+            output = str(event.get("output", ""))
+            if len(output) > self.max_tool_output:
+                output = output[:self.max_tool_output] + "…"
+            self._newline()
+            self._write(f"   ✅ {event['tool']} 完了: {output}\n")
+        self.stream.flush()
+
+    def finish(self, response: Optional[str] = None):
+        """表示を締めくくる。トークンが流れてこなかった場合は最終応答を表示する"""
+        if not self.printed_text and response:
+            self._write(f"   {response}")
+            self._at_line_start = False
+        self._newline()
+        self.stream.flush()
+
+    def _newline(self):
+        if not self._at_line_start:
+            self._write("\n")
+            self._at_line_start = True
+
+    def _write(self, text: str):
+        self.stream.write(text)
@@ -0,0 +1,423 @@
+"""TODOアイテムのストレージエンジン
+
+JSON Linesの追記専用ログに変更を1行ずつ記録し、メモリ上のインデックスで検索する。
+追加は1行の追記だけで済むため、件数が増えても1件あたりのコストは一定になる。
+ログが肥大化した場合は、現在のアイテムだけを書き出したログに置き換える（コンパクション）。
+インデックス（優先度・状態・作成日時・タスク文字列のbigram）はレコードを適用するたびに
+差分で更新するため、検索時にアイテム全体を走査しない。
+
+ログの各行:
+    {"op": "put", "item": {...}}     アイテムの追加・更新
+    {"op": "delete", "id": "..."}    アイテムの削除
+
+複数プロセスから同じログを使えるよう、読み書きはロックファイルへの排他ロック
+（fcntl.flock）の下で行い、他プロセスが追記した分はファイル末尾から差分で取り込む。
+ログ自体が先行書き込みジャーナルとして働き、クラッシュで途中まで書かれた末尾の行は
+次にロックを取ったプロセスが切り詰める。コンパクションは一時ファイルに書いて
+fsyncした後にrenameで置き換えるため、途中で中断しても元のログは壊れない。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス間ロックなし（スレッド間の排他のみ）
+    fcntl = None
+
+PRIORITIES = ("high", "medium", "low")
+
+# ULIDで使うCrockford Base32の文字集合
+_CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+class TodoIdGenerator:
+    """時刻順にソートできる重複しないIDを生成する（ULID形式、26文字）
+
+    先頭48ビットがミリ秒単位のUNIX時刻、残り80ビットが乱数。
+    同じミリ秒内では乱数部を1ずつ増やすため、プロセス内では単調増加する。
+    別プロセスとは80ビットの乱数で衝突を避ける。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def __call__(self) -> str:
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms <= self._last_ms:
+                # 同じミリ秒（または時計の巻き戻り）では乱数部を繰り上げる
+                now_ms = self._last_ms
+                random_part = self._last_random + 1
+                if random_part >= 1 << 80:
+                    now_ms += 1
+                    random_part = int.from_bytes(os.urandom(10), "big") >> 1
+            else:
+                # 繰り上げ用の余裕を残すため最上位ビットは0にする
+                random_part = int.from_bytes(os.urandom(10), "big") >> 1
+            self._last_ms = now_ms
+            self._last_random = random_part
+
+        value = (now_ms << 80) | random_part
+        chars = []
+        for _ in range(26):
+            chars.append(_CROCKFORD_BASE32[value & 0x1F])
+            value >>= 5
+        return "".join(reversed(chars))
+
+
+generate_todo_id = TodoIdGenerator()
+
+
+class TodoStore:
+    """追記専用ログとインデックスによるTODOストア
+
+    Args:
+        path: ログファイル（JSON Lines）のパス
+        legacy_path: 旧形式（JSON配列）のファイル。ログが無い場合に一度だけ取り込む
+        compact_min_records: コンパクションを検討する最小レコード数
+        compact_ratio: レコード数がアイテム数のこの倍率を超えたらコンパクションする
+        fsync: "always"（追記ごと）/ "compact"（コンパクション時のみ）/ "never"
+    """
+
+    FSYNC_POLICIES = ("always", "compact", "never")
+
+    def __init__(
+        self,
+        path: str = "todo_list.jsonl",
+        legacy_path: Optional[str] = "todo_list.json",
+        compact_min_records: int = 1000,
+        compact_ratio: float = 2.0,
+        fsync: str = "always",
+    ):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"不明なfsyncポリシーです: {fsync}")
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.legacy_path = legacy_path
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._reset_index()
+
+        with self._locked():
+            if not os.path.exists(self.path):
+                self._migrate_legacy()
+
+    def _reset_index(self):
+        self._items: Dict[str, dict] = {}
+        # 作成順を保つための通し番号（更新しても変わらない）
+        self._seq: Dict[str, int] = {}
+        self._next_seq = 0
+        self._by_priority: Dict[str, Set[str]] = {}
+        self._by_completed: Dict[bool, Set[str]] = {True: set(), False: set()}
+        # 作成日時の範囲検索用（(created_at, id)の昇順リスト）
+        self._by_created: List[Tuple[str, str]] = []
+        # 部分一致検索用（タスク文字列の2文字組 -> ID）
+        self._by_bigram: Dict[str, Set[str]] = {}
+        self._records = 0
+        # 取り込み済みのログの位置（inodeが変わったらコンパクションされたとみなす）
+        self._inode: Optional[int] = None
+        self._offset = 0
+
+    # ------------------------------------------------------------------
+    # ロック
+    # ------------------------------------------------------------------
+    @contextmanager
+    def _locked(self):
+        """スレッド間・プロセス間の排他ロックを取り、ログの差分を取り込む"""
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_file is None:
+                    self._lock_file = open(self.lock_path, "a")
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1:
+                    self._refresh()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # 読み込み
+    # ------------------------------------------------------------------
+    def _refresh(self):
+        """他のプロセスが書いた分をログから取り込む（ロック取得中に呼ぶこと）"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset_index()
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # コンパクションで置き換えられたので最初から読み直す
+            self._reset_index()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._apply(record)
+            self._records += 1
+        self._offset += end
+        if end < len(data):
+            # ロック中に改行で終わらない末尾があるのは書き込み途中のクラッシュなので切り詰める
+            with open(self.path, "r+b") as f:
+                f.truncate(self._offset)
+
+    def _migrate_legacy(self):
+        """旧形式のJSON配列ファイルをログに取り込む"""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                legacy_items = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        if isinstance(legacy_items, list):
+            self._append([{"op": "put", "item": item} for item in legacy_items
+                          if isinstance(item, dict) and "id" in item])
+
+    # ------------------------------------------------------------------
+    # インデックス
+    # ------------------------------------------------------------------
+    def _apply(self, record: dict):
+        op = record.get("op")
+        if op == "put" and isinstance(record.get("item"), dict):
+            item = record["item"]
+            item_id = item["id"]
+            old = self._items.get(item_id)
+            if old is not None:
+                self._unindex(item_id, old)
+            else:
+                self._seq[item_id] = self._next_seq
+                self._next_seq += 1
+            # 既存キーへの代入なので作成順は保たれる
+            self._items[item_id] = item
+            self._index(item_id, item)
+        elif op == "delete":
+            old = self._items.pop(record.get("id"), None)
+            if old is not None:
+                self._unindex(old["id"], old)
+                del self._seq[old["id"]]
+
+    def _index(self, item_id: str, item: dict):
+        self._by_priority.setdefault(item.get("priority", "medium"), set()).add(item_id)
+        self._by_completed[bool(item.get("completed"))].add(item_id)
+        bisect.insort(self._by_created, (item.get("created_at", ""), item_id))
+        for gram in _bigrams(item.get("task", "")):
+            self._by_bigram.setdefault(gram, set()).add(item_id)
+
+    def _unindex(self, item_id: str, item: dict):
+        self._by_priority.get(item.get("priority", "medium"), set()).discard(item_id)
+        self._by_completed[bool(item.get("completed"))].discard(item_id)
+        key = (item.get("created_at", ""), item_id)
+        i = bisect.bisect_left(self._by_created, key)
+        if i < len(self._by_created) and self._by_created[i] == key:
+            del self._by_created[i]
+        for gram in _bigrams(item.get("task", "")):
+            ids = self._by_bigram.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._by_bigram[gram]
+
+    # ------------------------------------------------------------------
+    # 書き込み
+    # ------------------------------------------------------------------
+    def _append(self, records: List[dict]):
+        """レコードをログに追記してインデックスに反映する"""
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        with self._locked():
+            # 1回のwriteでまとめて書くので、他プロセスの行と混ざらない
+            with open(self.path, "ab") as f:
+                f.write(data)
+                f.flush()
+                if self.fsync == "always":
+                    os.fsync(f.fileno())
+                if self._inode is None:
+                    self._inode = os.fstat(f.fileno()).st_ino
+            self._offset += len(data)
+            for record in records:
+                self._apply(record)
+            self._records += len(records)
+            self._maybe_compact()
+
+    def add(self, item: dict) -> dict:
+        """アイテムを追加"""
+        self._append([{"op": "put", "item": item}])
+        return item
+
+    def add_many(self, items: List[dict]) -> List[dict]:
+        """複数のアイテムを1回の書き込みで追加"""
+        self._append([{"op": "put", "item": item} for item in items])
+        return items
+
+    def update(self, item_id: str, **changes) -> Optional[dict]:
+        """アイテムの一部の項目を更新（存在しない場合はNone）"""
+        with self._locked():
+            current = self._items.get(item_id)
+            if current is None:
+                return None
+            # インデックスが参照している辞書は書き換えずに新しい辞書で置き換える
+            item = {**current, **changes, "id": item_id}
+            self._append([{"op": "put", "item": item}])
+            return item
+
+    def delete(self, item_id: str) -> Optional[dict]:
+        """アイテムを削除（削除したアイテムを返す。存在しない場合はNone）"""
+        with self._locked():
+            item = self._items.get(item_id)
+            if item is not None:
+                self._append([{"op": "delete", "id": item_id}])
+            return item
+
+    def _maybe_compact(self):
+        if (self._records >= self.compact_min_records
+                and self._records > len(self._items) * self.compact_ratio):
+            self.compact()
+
+    def compact(self):
+        """現在のアイテムだけを含むログにアトミックに置き換える"""
+        with self._locked():
+            data = "".join(
+                json.dumps({"op": "put", "item": item}, ensure_ascii=False) + "\n"
+                for item in self._items.values()
+            ).encode("utf-8")
+            tmp_path = f"{self.path}.{os.getpid()}.compact"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if self.fsync != "never":
+                _fsync_directory(self.path)
+            self._inode = os.stat(self.path).st_ino
+            self._offset = len(data)
+            self._records = len(self._items)
+
+    # ------------------------------------------------------------------
+    # 参照
+    # ------------------------------------------------------------------
+    def get(self, item_id: str) -> Optional[dict]:
+        """IDでアイテムを取得"""
+        with self._locked():
+            return self._items.get(item_id)
+
+    def items(self, priority: Optional[str] = None,
+              completed: Optional[bool] = None) -> List[dict]:
+        """条件に合うアイテムを作成順に取得"""
+        with self._locked():
+            ids: Optional[Set[str]] = None
+            if priority is not None:
+                ids = set(self._by_priority.get(priority, set()))
+            if completed is not None:
+                status_ids = self._by_completed[completed]
+                ids = set(status_ids) if ids is None else ids & status_ids
+            if ids is None:
+                return list(self._items.values())
+            return [self._items[i] for i in sorted(ids, key=self._seq.__getitem__)]
+
+    def query(self, priority: Optional[str] = None, completed: Optional[bool] = None,
+              created_from: Optional[str] = None, created_to: Optional[str] = None,
+              text: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """インデックスを使ってアイテムを検索し、作成順に返す
+
+        Args:
+            priority: 優先度
+            completed: 完了状態
+            created_from: 作成日時の下限（ISO形式の文字列、この値を含む）
+            created_to: 作成日時の上限（ISO形式の文字列、この値を含まない）
+            text: タスクに含まれる文字列（大文字・小文字を区別しない）
+            limit: 返す最大件数
+        """
+        with self._locked():
+            # 絞り込みの効く条件から順に候補を狭める
+            candidates: List[Set[str]] = []
+            if priority is not None:
+                candidates.append(self._by_priority.get(priority, set()))
+            if completed is not None:
+                candidates.append(self._by_completed[completed])
+            if created_from is not None or created_to is not None:
+                lo = 0 if created_from is None else bisect.bisect_left(
+                    self._by_created, (created_from, ""))
+                hi = len(self._by_created) if created_to is None else bisect.bisect_left(
+                    self._by_created, (created_to, ""))
+                candidates.append({item_id for _, item_id in self._by_created[lo:hi]})
+            needle = text.lower() if text else None
+            if needle and len(needle) >= 2:
+                for gram in _bigrams(needle):
+                    candidates.append(self._by_bigram.get(gram, set()))
+
+            if candidates:
+                candidates.sort(key=len)
+                ids = set(candidates[0]).intersection(*candidates[1:])
+                items = [self._items[i] for i in sorted(ids, key=self._seq.__getitem__)]
+            else:
+                items = list(self._items.values())
+            if needle:
+                # bigramの一致は候補の絞り込みなので、最後に部分一致を確認する
+                items = [item for item in items if needle in item.get("task", "").lower()]
+            return items if limit is None else items[:limit]
+
+    def __len__(self) -> int:
+        with self._locked():
+            return len(self._items)
+
+    def __contains__(self, item_id: str) -> bool:
+        with self._locked():
+            return item_id in self._items
+
+    def __iter__(self) -> Iterator[dict]:
+        with self._locked():
+            return iter(list(self._items.values()))
+
+    def close(self):
+        """ロックファイルを閉じる"""
+        with self._lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+def _bigrams(text: str) -> Set[str]:
+    """部分一致検索用に文字列を2文字ずつの組に分解する"""
+    text = text.lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _fsync_directory(path: str):
+    """renameをディスクに反映させるため、親ディレクトリをfsyncする"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,19 +1,180 @@
 """LangChainエージェント用のツール関数群"""
+import asyncio
+import atexit
+import base64
+import codecs
+import contextvars
+import functools
 import json
-from datetime import datetime
+import mimetypes
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from langchain.tools import tool
-from bedrock_agentcore.tools.code_interpreter_client import CodeInterpreter
+from pydantic import BaseModel, Field
+from code_interpreter_pool import CodeInterpreterPool, PooledSession
+from file_transfer import CodeRunner, TransferError, download_file, upload_bytes
+from math_engine import evaluate, evaluate_batch, format_result, make_range, summarize_batch
+from output_governor import ArtifactStore, OutputGovernor
+from streaming import emit_tool_output
+from todo_store import TodoStore, generate_todo_id
+
+# Code Interpreterセッションプールの管理
+_CODE_INTERPRETER_POOL = None
+_CODE_INTERPRETER_POOL_LOCK = threading.Lock()
+
+# TODOストアの管理
+_TODO_STORE = None
+_TODO_STORE_LOCK = threading.Lock()
+
+# ツール出力の大きさの管理
+_OUTPUT_GOVERNOR = None
+_OUTPUT_GOVERNOR_LOCK = threading.Lock()
+
+# 非同期実行時にブロッキングするCode Interpreter呼び出しを流すスレッドプール
+_ASYNC_TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CODE_INTERPRETER_ASYNC_WORKERS", "32")),
+    thread_name_prefix="code-interpreter-tool",
+)
+
+
+def _create_code_interpreter():
+    """Code Interpreterセッションを起動"""
+    # boto3を含むため、最初にセッションが必要になるまでインポートしない
+    from bedrock_agentcore.tools.code_interpreter_client import CodeInterpreter
+    
+    client = CodeInterpreter(os.getenv("CODE_INTERPRETER_REGION", "us-west-2"))
+    client.start()
+    return client
+
+
+def _agentcore_backend() -> Callable[[], Any]:
+    """AWS Bedrock AgentCoreのCode Interpreterを使う"""
+    return _create_code_interpreter
+
+
+def _local_backend() -> Callable[[], Any]:
+    """ローカルのワーカープロセスで実行する（信頼できる環境・オフライン用）"""
+    from local_interpreter import LocalInterpreterFactory, parse_preimports
+    
+    factory = LocalInterpreterFactory(
+        spares=int(os.getenv("LOCAL_INTERPRETER_SPARES", "1")),
+        timeout=float(os.getenv("LOCAL_INTERPRETER_TIMEOUT", "300")),
+        memory_mb=int(os.getenv("LOCAL_INTERPRETER_MEMORY_MB", "2048")),
+        file_size_mb=int(os.getenv("LOCAL_INTERPRETER_FILE_SIZE_MB", "512")),
+        preimports=parse_preimports(os.getenv("LOCAL_KERNEL_PREIMPORTS", "")),
+    )
+    atexit.register(factory.shutdown)
+    return factory
 
-# Code Interpreterセッションの管理
-_CODE_INTERPRETER_CLIENT = None
 
-def _get_code_interpreter():
-    """共有Code Interpreterセッションを取得"""
-    global _CODE_INTERPRETER_CLIENT
-    if _CODE_INTERPRETER_CLIENT is None:
-        _CODE_INTERPRETER_CLIENT = CodeInterpreter('us-west-2')
-        _CODE_INTERPRETER_CLIENT.start()
-    return _CODE_INTERPRETER_CLIENT
+# Python実行バックエンド（名前 -> 起動済みクライアントを返すファクトリを作る関数）
+EXECUTION_BACKENDS: Dict[str, Callable[[], Callable[[], Any]]] = {
+    "agentcore": _agentcore_backend,
+    "local": _local_backend,
+}
+
+
+def _get_code_interpreter_pool() -> CodeInterpreterPool:
+    """共有Code Interpreterセッションプールを取得"""
+    global _CODE_INTERPRETER_POOL
+    if _CODE_INTERPRETER_POOL is None:
+        with _CODE_INTERPRETER_POOL_LOCK:
+            if _CODE_INTERPRETER_POOL is None:
+                backend = os.getenv("PYTHON_EXECUTION_BACKEND", "agentcore")
+                if backend not in EXECUTION_BACKENDS:
+                    raise ValueError(f"不明なPython実行バックエンドです: {backend}")
+                pool = CodeInterpreterPool(
+                    EXECUTION_BACKENDS[backend](),
+                    min_size=int(os.getenv("CODE_INTERPRETER_POOL_MIN", "0")),
+                    max_size=int(os.getenv("CODE_INTERPRETER_POOL_MAX", "4")),
+                    idle_timeout=float(os.getenv("CODE_INTERPRETER_IDLE_TIMEOUT", "600")),
+                )
+                atexit.register(pool.shutdown)
+                _CODE_INTERPRETER_POOL = pool
+    return _CODE_INTERPRETER_POOL
+
+
+def _get_todo_store() -> TodoStore:
+    """共有TODOストアを取得"""
+    global _TODO_STORE
+    if _TODO_STORE is None:
+        with _TODO_STORE_LOCK:
+            if _TODO_STORE is None:
+                _TODO_STORE = TodoStore(
+                    os.getenv("TODO_STORE_PATH", "todo_list.jsonl"),
+                    fsync=os.getenv("TODO_STORE_FSYNC", "always"),
+                )
+    return _TODO_STORE
+
+
+def _get_output_governor() -> OutputGovernor:
+    """共有の出力ガバナーを取得"""
+    global _OUTPUT_GOVERNOR
+    if _OUTPUT_GOVERNOR is None:
+        with _OUTPUT_GOVERNOR_LOCK:
+            if _OUTPUT_GOVERNOR is None:
+                _OUTPUT_GOVERNOR = OutputGovernor(
+                    max_chars=int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "4000")),
+                    max_tokens=int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "2000")),
+                    store=ArtifactStore(os.getenv("TOOL_OUTPUT_ARTIFACT_DIR", ".tool_outputs")),
+                )
+    return _OUTPUT_GOVERNOR
+
+
+def warm_up_code_interpreter(size: Optional[int] = None) -> Future:
+    """Code Interpreterセッションをバックグラウンドで事前に起動する
+
+    ツールは最初の呼び出し時にこのFutureの完了を待ってからセッションを借りる。
+    """
+    return _get_code_interpreter_pool().warm_up(size)
+
+
+def _execute_code(code: str, tool_name: Optional[str] = None) -> list:
+    """プールからセッションを借りてコードを実行し、ストリームのイベントを返す
+    
+    tool_nameを指定すると、標準出力・標準エラーをイベントが届くたびに
+    tool_outputイベントとして転送する（CLIやサーバーの逐次表示用）。
+    """
+    with _get_code_interpreter_pool().lease() as session:
+        response = session.invoke("executeCode", {
+            "language": "python",
+            "code": code
+        })
+        # リース中にストリームを読み切る（エラー時はセッションが破棄される）
+        events = []
+        for event in response["stream"]:
+            events.append(event)
+            if tool_name is not None:
+                structured = event.get("result", {}).get("structuredContent", {})
+                emit_tool_output(tool_name, "stdout", structured.get("stdout", ""))
+                emit_tool_output(tool_name, "stderr", structured.get("stderr", ""))
+        return events
+
+
+def _code_runner(session: PooledSession) -> CodeRunner:
+    """借りたセッションで複数回コードを実行するための関数を返す
+
+    ファイル転送のように、複数回の実行が同じセッションで行われる必要がある処理で使う。
+    """
+    def run(code: str) -> Tuple[str, str]:
+        response = session.invoke("executeCode", {
+            "language": "python",
+            "code": code
+        })
+        events = list(response["stream"])
+        return _collect_output(events, "stdout"), _collect_output(events, "stderr")
+    return run
+
+
+def _collect_output(events: list, key: str = "stdout") -> str:
+    """イベントの標準出力（または標準エラー）をつなげる"""
+    return "".join(
+        event["result"].get("structuredContent", {}).get(key, "") or ""
+        for event in events if "result" in event
+    )
 
 
 @tool
@@ -56,71 +217,86 @@ def calculate_math_expression(expression: str) -> str:
     Returns:
         str: 計算結果の文字列
     """
-    import math
-    
-    # 安全な計算のために許可する関数を定義
-    allowed_names = {
-        k: v for k, v in math.__dict__.items() if not k.startswith("__")
-    }
-    allowed_names.update({
-        "abs": abs,
-        "round": round,
-        "min": min,
-        "max": max,
-        "sum": sum,
-        "pow": pow,
-    })
-    
     try:
-        # 危険な関数呼び出しを避けるために制限付きで評価
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
-        return f"計算結果: {expression} = {result}"
+        # 検証済みのコンパイル結果を再利用して評価
+        result = evaluate(expression)
+        return f"計算結果: {expression} = {format_result(result)}"
     except Exception as e:
         return f"計算エラー: {expression} を計算できませんでした。\n" \
                f"エラー詳細: {str(e)}\n" \
                f"使用可能な関数: sin, cos, tan, sqrt, log, exp, pi, e など"
 
 
+class VariableRange(BaseModel):
+    """一括計算する変数の値の範囲"""
+    start: Optional[float] = Field(default=None, description="開始値")
+    stop: Optional[float] = Field(default=None, description="終了値（この値を含む）")
+    step: float = Field(default=1.0, description="刻み幅")
+    values: Optional[List[float]] = Field(default=None, description="範囲の代わりに値を直接指定する場合のリスト")
+
+
 @tool
-def create_todo_item(task: str, priority: str = "medium") -> str:
-    """TODOアイテムを作成してJSONファイルに保存する関数
+def calculate_math_table(expression: str, variables: Dict[str, VariableRange],
+                         max_rows: int = 20) -> str:
+    """変数の範囲に対して数式をまとめて計算し、統計値と抜粋した表を返す関数
+    
+    「xが0から10まで0.01刻みのときのf(x)」のような表や最大・最小を求める場合は、
+    calculate_math_expressionを繰り返し呼ぶ代わりにこちらを使う。
+    変数が複数ある場合はすべての組み合わせで計算する。
     
     Args:
-        task: タスクの内容
-        priority: 優先度（"high", "medium", "low"のいずれか）
+        expression: 計算したい数式（例: "sin(x) * exp(-x / 5)"）
+        variables: 変数名と範囲（例: {"x": {"start": 0, "stop": 10, "step": 0.01}}）
+        max_rows: 表に載せる最大行数
     
     Returns:
-        str: 作成されたTODOアイテムの情報
+        str: 点の数、最小値・最大値・平均、抜粋した表
     """
-    import os
-    
-    todo_file = "todo_list.json"
-    
-    # TODOアイテムの作成
-    todo_item = {
-        "id": datetime.now().strftime("%Y%m%d_%H%M%S"),
+    try:
+        axes = {}
+        for name, spec in variables.items():
+            if isinstance(spec, dict):
+                spec = VariableRange(**spec)
+            if spec.values is not None:
+                axes[name] = spec.values
+            elif spec.start is not None and spec.stop is not None:
+                axes[name] = make_range(spec.start, spec.stop, spec.step)
+            else:
+                return f"計算エラー: 変数 {name} の範囲（start と stop）または values を指定してください。"
+        result = evaluate_batch(expression, axes)
+    except Exception as e:
+        return f"計算エラー: {expression} を計算できませんでした。\n" \
+               f"エラー詳細: {str(e)}"
+    return f"計算結果: {expression}\n{summarize_batch(result, max_rows=max(1, max_rows))}"
+
+
+def _new_todo_item(task: str, priority: str) -> dict:
+    """TODOアイテムの辞書を作成（IDは時刻順にソートでき、同じ秒に作成しても重複しない）"""
+    return {
+        "id": generate_todo_id(),
         "task": task,
         "priority": priority,
         "created_at": datetime.now().isoformat(),
         "completed": False
     }
+
+
+@tool
+def create_todo_item(task: str, priority: str = "medium") -> str:
+    """TODOアイテムを作成してTODOストアに保存する関数
     
-    # 既存のTODOリストを読み込み
-    if os.path.exists(todo_file):
-        try:
-            with open(todo_file, "r", encoding="utf-8") as f:
-                todo_list = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            todo_list = []
-    else:
-        todo_list = []
+    Args:
+        task: タスクの内容
+        priority: 優先度（"high", "medium", "low"のいずれか）
     
-    # 新しいTODOアイテムを追加
-    todo_list.append(todo_item)
+    Returns:
+        str: 作成されたTODOアイテムの情報
+    """
+    # TODOアイテムの作成
+    todo_item = _new_todo_item(task, priority)
     
-    # ファイルに保存
-    with open(todo_file, "w", encoding="utf-8") as f:
-        json.dump(todo_list, f, ensure_ascii=False, indent=2)
+    # ログに1行追記するだけで保存される
+    _get_todo_store().add(todo_item)
     
     return f"TODOアイテムを作成しました:\n" \
            f"ID: {todo_item['id']}\n" \
@@ -129,9 +305,163 @@ def create_todo_item(task: str, priority: str = "medium") -> str:
            f"作成日時: {todo_item['created_at']}"
 
 
+class TodoItemInput(BaseModel):
+    """一括作成するTODOアイテム"""
+    task: str = Field(description="タスクの内容")
+    priority: str = Field(default="medium", description='優先度（"high", "medium", "low"のいずれか）')
+
+
+@tool
+def create_todo_items(items: List[TodoItemInput]) -> str:
+    """複数のTODOアイテムをまとめて作成してTODOストアに保存する関数
+    
+    複数のタスクを追加する場合は、create_todo_itemを繰り返し呼ぶ代わりにこちらを使う。
+    
+    Args:
+        items: 作成するTODOアイテムのリスト（各要素は task と priority を持つ）
+    
+    Returns:
+        str: 作成されたTODOアイテムの一覧
+    """
+    if not items:
+        return "作成するTODOアイテムが指定されていません。"
+    
+    todo_items = [
+        _new_todo_item(item.task, item.priority) if isinstance(item, TodoItemInput)
+        else _new_todo_item(item["task"], item.get("priority", "medium"))
+        for item in items
+    ]
+    
+    # 全件を1回の追記で保存
+    _get_todo_store().add_many(todo_items)
+    
+    lines = [f"{len(todo_items)}件のTODOアイテムを作成しました:"]
+    for todo_item in todo_items:
+        lines.append(f"- [{todo_item['priority']}] {todo_item['task']} (ID: {todo_item['id']})")
+    return "\n".join(lines)
+
+
+def _format_todo_item(item: dict) -> str:
+    """TODOアイテムを1行で表示する形式に変換"""
+    mark = "✅" if item.get("completed") else "⬜"
+    return (f"{mark} [{item.get('priority', 'medium')}] {item.get('task', '')} "
+            f"(ID: {item['id']}, 作成: {item.get('created_at', '-')})")
+
+
+def _next_day(value: str) -> str:
+    """日付のみ（YYYY-MM-DD）の上限をその日の終わりまで含むよう翌日に変換"""
+    if len(value) == 10:
+        return (datetime.fromisoformat(value) + timedelta(days=1)).date().isoformat()
+    return value
+
+
+@tool
+def list_todo_items(priority: Optional[str] = None, status: str = "open",
+                    created_from: Optional[str] = None, created_to: Optional[str] = None,
+                    text: Optional[str] = None, limit: int = 50) -> str:
+    """TODOアイテムを検索して一覧表示する関数
+    
+    Args:
+        priority: 優先度で絞り込む（"high", "medium", "low"）
+        status: "open"（未完了）、"completed"（完了）、"all"（すべて）のいずれか
+        created_from: 作成日の下限（YYYY-MM-DD またはISO形式、この日を含む）
+        created_to: 作成日の上限（YYYY-MM-DD またはISO形式、この日を含む）
+        text: タスクに含まれる文字列
+        limit: 表示する最大件数
+    
+    Returns:
+        str: 条件に合うTODOアイテムの一覧
+    """
+    if status not in ("open", "completed", "all"):
+        return f"不明なstatusです: {status}（open / completed / all のいずれかを指定してください）"
+    completed = None if status == "all" else status == "completed"
+    try:
+        created_to = _next_day(created_to) if created_to else None
+    except ValueError:
+        return f"日付の形式が正しくありません: {created_to}"
+    
+    items = _get_todo_store().query(
+        priority=priority, completed=completed, created_from=created_from,
+        created_to=created_to, text=text, limit=limit + 1,
+    )
+    if not items:
+        return "条件に合うTODOアイテムはありません。"
+    
+    lines = [f"{min(len(items), limit)}件のTODOアイテム:"]
+    lines.extend(_format_todo_item(item) for item in items[:limit])
+    if len(items) > limit:
+        lines.append("...ほかにもあります（limitを増やすか条件を絞ってください）")
+    return "\n".join(lines)
+
+
+@tool
+def update_todo_item(item_id: str, task: Optional[str] = None,
+                     priority: Optional[str] = None) -> str:
+    """TODOアイテムのタスク内容や優先度を変更する関数
+    
+    Args:
+        item_id: 変更するTODOアイテムのID
+        task: 新しいタスクの内容
+        priority: 新しい優先度（"high", "medium", "low"のいずれか）
+    
+    Returns:
+        str: 変更後のTODOアイテムの情報
+    """
+    changes = {}
+    if task is not None:
+        changes["task"] = task
+    if priority is not None:
+        changes["priority"] = priority
+    if not changes:
+        return "変更する項目が指定されていません。"
+    changes["updated_at"] = datetime.now().isoformat()
+    
+    item = _get_todo_store().update(item_id, **changes)
+    if item is None:
+        return f"TODOアイテムが見つかりません: {item_id}"
+    return f"TODOアイテムを更新しました:\n{_format_todo_item(item)}"
+
+
+@tool
+def complete_todo_item(item_id: str, completed: bool = True) -> str:
+    """TODOアイテムを完了（または未完了に戻す）にする関数
+    
+    Args:
+        item_id: TODOアイテムのID
+        completed: Trueで完了、Falseで未完了に戻す
+    
+    Returns:
+        str: 変更後のTODOアイテムの情報
+    """
+    item = _get_todo_store().update(
+        item_id, completed=completed,
+        completed_at=datetime.now().isoformat() if completed else None,
+    )
+    if item is None:
+        return f"TODOアイテムが見つかりません: {item_id}"
+    state = "完了にしました" if completed else "未完了に戻しました"
+    return f"TODOアイテムを{state}:\n{_format_todo_item(item)}"
+
+
+@tool
+def delete_todo_item(item_id: str) -> str:
+    """TODOアイテムを削除する関数
+    
+    Args:
+        item_id: 削除するTODOアイテムのID
+    
+    Returns:
+        str: 削除結果
+    """
+    item = _get_todo_store().delete(item_id)
+    if item is None:
+        return f"TODOアイテムが見つかりません: {item_id}"
+    return f"TODOアイテムを削除しました:\n{_format_todo_item(item)}"
+
+
 @tool
 def execute_python_code(code: str) -> str:
-    """AWS Code Interpreterを使用してPythonコードを実行し、結果を返す関数
+    """Code Interpreter（AWSまたはローカルの実行バックエンド）でPythonコードを実行し、結果を返す関数
     
     Args:
         code: 実行したいPythonコード
@@ -140,48 +470,21 @@ def execute_python_code(code: str) -> str:
         str: コード実行結果の文字列
     """
     try:
+        # プールから借りたセッションでコードを実行（出力は届いた順に逐次転送される）
+        events = _execute_code(code, tool_name="execute_python_code")
         
-        # 共有Code Interpreterセッションを取得
-        code_client = _get_code_interpreter()
-        
-        # コードの実行
-        response = code_client.invoke("executeCode", {
-            "language": "python",
-            "code": code
-        })
-        
-        # ストリーミングレスポンスから結果を抽出
-        outputs = []
-        errors = []
-        
-        for event in response["stream"]:
-            if "result" not in event:
-                continue
-                
-            result_data = event["result"]
-            
-            # structuredContentから出力を取得（メイン）
-            if "structuredContent" in result_data:
-                structured = result_data["structuredContent"]
-                
-                # 標準出力（print文の結果）
-                stdout = structured.get("stdout", "")
-                if stdout and stdout.strip():
-                    outputs.append(stdout.strip())
-                
-                # エラー出力
-                stderr = structured.get("stderr", "") 
-                if stderr and stderr.strip():
-                    errors.append(stderr.strip())
+        # ストリーミングレスポンスから結果を抽出（出力は複数のイベントに分かれて届く場合がある）
+        stdout = _collect_output(events, "stdout").strip()
+        stderr = _collect_output(events, "stderr").strip()
         
-        # クリーンアップ
-        # セッションは共有なので停止しない
+        # セッションはプールに返却済みなので停止しない
         
         # 結果をシンプルに返す（Claudeが適切に解釈するため）
-        if outputs:
-            return "\n".join(outputs)
-        elif errors:
-            return f"エラー: \n" + "\n".join(errors)
+        # 長い出力は上限に収まるよう要約し、全文はアーティファクトとして保存する
+        if stdout:
+            return _get_output_governor().govern(stdout)
+        elif stderr:
+            return f"エラー: \n" + _get_output_governor().govern(stderr)
         else:
             return "実行完了（出力なし）"
         
@@ -190,6 +493,24 @@ def execute_python_code(code: str) -> str:
                f"実行しようとしたコード:\n```python\n{code}\n```"
 
 
+@tool
+def read_tool_output(artifact_id: str, start_line: int = 1, num_lines: int = 100) -> str:
+    """長いために要約されたツール出力の全文を、行を指定して読む関数
+    
+    Args:
+        artifact_id: ツール結果に示されたアーティファクトID
+        start_line: 読み始める行番号（1から）
+        num_lines: 読む行数
+    
+    Returns:
+        str: 指定した範囲の出力
+    """
+    page = _get_output_governor().page(artifact_id, start_line, num_lines)
+    if page is None:
+        return f"アーティファクトが見つかりません: {artifact_id}"
+    return page
+
+
 @tool  
 def list_code_interpreter_files() -> str:
     """Code Interpreterセッション内のファイル一覧を表示する関数
@@ -198,9 +519,6 @@ def list_code_interpreter_files() -> str:
         str: ファイル一覧の文字列
     """
     try:
-        # 共有Code Interpreterセッションを取得
-        code_client = _get_code_interpreter()
-        
         # executeCodeでファイル一覧取得（より確実）
         list_code = """
 import os
@@ -222,19 +540,12 @@ else:
             print(f"📁 {filename}/ (ディレクトリ)")
 """
         
-        response = code_client.invoke("executeCode", {
-            "language": "python",
-            "code": list_code
-        })
+        events = _execute_code(list_code)
         
         # 実行結果を取得
-        for event in response["stream"]:
-            if "result" in event:
-                result_data = event["result"]
-                if "structuredContent" in result_data:
-                    stdout = result_data["structuredContent"].get("stdout", "")
-                    if stdout:
-                        return stdout.strip()
+        stdout = _collect_output(events)
+        if stdout.strip():
+            return stdout.strip()
         
         return "ファイル一覧の取得に失敗しました。"
             
@@ -243,134 +554,155 @@ else:
 
 
 @tool
-def save_file_to_code_interpreter(file_path: str, content: str) -> str:
-    """Code Interpreterセッションにファイルを保存する関数（executeCode使用）
+def save_file_to_code_interpreter(file_path: str, content: Optional[str] = None,
+                                  source_path: Optional[str] = None,
+                                  content_base64: bool = False) -> str:
+    """Code Interpreterセッションにファイルを保存する関数
+
+    内容はチャンクに分けて圧縮・base64エンコードして送り、SHA-256で検証する。
+    大きなファイルやバイナリもそのまま保存でき、途中で失敗しても再実行すると続きから送る。
     
     Args:
-        file_path: 保存するファイルのパス
-        content: ファイルの内容
+        file_path: 保存するファイルのパス（セッション内）
+        content: ファイルの内容（source_pathを指定する場合は不要）
+        source_path: アップロードするローカルファイルのパス（データセットなど大きなファイル向け）
+        content_base64: contentがbase64エンコードされたバイナリの場合はTrue
         
     Returns:
         str: 保存結果
     """
     try:
-        # 共有Code Interpreterセッションを取得
-        code_client = _get_code_interpreter()
-        
-        # executeCodeでファイル保存（より確実）
-        save_code = f"""
-import os
-# ファイルを保存
-with open('{file_path}', 'w', encoding='utf-8') as f:
-    f.write('''{content}''')
-
-# 保存確認
-if os.path.exists('{file_path}'):
-    file_size = os.path.getsize('{file_path}')
-    print(f"✅ ファイル '{file_path}' を保存しました（サイズ: {{file_size}} bytes）")
-else:
-    print(f"❌ ファイル '{file_path}' の保存に失敗しました")
-"""
-        
-        response = code_client.invoke("executeCode", {
-            "language": "python",
-            "code": save_code
-        })
-        
-        # 実行結果を取得
-        for event in response["stream"]:
-            if "result" in event:
-                result_data = event["result"]
-                if "structuredContent" in result_data:
-                    stdout = result_data["structuredContent"].get("stdout", "")
-                    if stdout:
-                        return stdout.strip()
-        
-        return f"✅ ファイル '{file_path}' を保存しました"
+        if source_path is not None:
+            with open(source_path, "rb") as f:
+                data = f.read()
+        elif content is None:
+            return "ファイル保存エラー: content か source_path を指定してください"
+        elif content_base64:
+            data = base64.b64decode(content, validate=True)
+        else:
+            data = content.encode("utf-8")
+
+        chunk_size = int(os.getenv("CODE_INTERPRETER_UPLOAD_CHUNK_KB", "1024")) * 1024
+        with _get_code_interpreter_pool().lease() as session:
+            run = _code_runner(session)
+            # 検証エラーではセッションを破棄せず、残った一時ファイルの続きから1回だけ再送する
+            for _ in range(2):
+                try:
+                    result = upload_bytes(run, file_path, data, chunk_size=chunk_size,
+                                          index=session.file_index)
+                    break
+                except TransferError as e:
+                    error = e
+            else:
+                return f"ファイル保存エラー: {error}"
+
+        message = (f"✅ ファイル '{file_path}' を保存しました"
+                   f"（サイズ: {result['size']} bytes, SHA-256: {result['sha256'][:16]}…）")
+        if result["copied_from"] is not None:
+            message += f"\n同じ内容の '{result['copied_from']}' をセッション内でコピーしました（転送なし）"
+        elif result["chunks"] == 0:
+            message += "\n同じ内容のファイルが既にあるため転送を省略しました"
+        elif result["resumed_from"]:
+            message += f"\n{result['resumed_from']} bytes目から転送を再開しました"
+        return message
         
     except Exception as e:
         return f"ファイル保存エラー: {str(e)}"
 
 
+# ダウンロードしたファイルのうち、プレビューのために読み込む最大バイト数
+_PREVIEW_READ_BYTES = 1024 * 1024
+
+
+def _preview_downloaded_file(local_path: str, size: int) -> str:
+    """ダウンロードしたファイルの、LLMに返す大きさに収めたプレビュー"""
+    with open(local_path, "rb") as f:
+        head = f.read(_PREVIEW_READ_BYTES)
+    try:
+        if b"\x00" in head:
+            raise UnicodeDecodeError("utf-8", head, 0, 1, "NUL")
+        # 読み込んだ範囲の末尾で切れた文字は無視する
+        text = codecs.getincrementaldecoder("utf-8")().decode(head, final=len(head) >= size)
+    except UnicodeDecodeError:
+        mime_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+        return f"(バイナリファイル: {mime_type}。先頭16バイト: {head[:16].hex(' ')})"
+    if len(head) < size:
+        budget = _get_output_governor().budget(text)
+        return f"{text[:budget]}\n... (先頭 {len(head)} bytes のうち {budget} 文字を表示。全体は {size} bytes)"
+    return _get_output_governor().govern(text)
+
+
 @tool
 def download_code_interpreter_file(file_path: str) -> str:
-    """Code Interpreterセッション内のファイルをダウンロードして内容を表示する関数（executeCode使用）
+    """Code Interpreterセッション内のファイルをダウンロードして内容を表示する関数
+    
+    ファイル全体をチャンクごとに受け取ってローカルのキャッシュに保存し（SHA-256で検証）、
+    LLMには大きさを制限したプレビューのみを返す。
     
     Args:
         file_path: ダウンロードしたいファイルのパス
         
     Returns:
-        str: ファイル内容またはダウンロード結果
+        str: 保存先とファイル内容のプレビュー
     """
     try:
-        # 共有Code Interpreterセッションを取得
-        code_client = _get_code_interpreter()
-        
-        # executeCodeでファイル読み取り（より確実）
-        read_code = f"""
-import os
-
-file_path = '{file_path}'
+        chunk_size = int(os.getenv("CODE_INTERPRETER_DOWNLOAD_CHUNK_KB", "1024")) * 1024
+        directory = os.getenv("CODE_INTERPRETER_DOWNLOAD_DIR", ".downloads")
+        with _get_code_interpreter_pool().lease() as session:
+            run = _code_runner(session)
+            try:
+                result = download_file(run, file_path, directory, chunk_size=chunk_size)
+            except FileNotFoundError as e:
+                return f"❌ {e}"
+            except TransferError as e:
+                return f"ファイルダウンロードエラー: {e}"
 
-# ファイルの存在確認
-if not os.path.exists(file_path):
-    print(f"❌ ファイル '{{file_path}}' が見つかりませんでした。")
-else:
-    # ファイルサイズを確認
-    file_size = os.path.getsize(file_path)
-    print(f"📄 ファイル '{{file_path}}' の内容 ({{file_size}} bytes):")
-    print("-" * 50)
-    
-    # テキストファイルとして読み取り試行
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            if len(content) > 2000:
-                print(content[:2000])
-                print(f"\\n... (残り {{len(content) - 2000}} 文字)")
-            else:
-                print(content)
-    except UnicodeDecodeError:
-        # バイナリファイルの場合
-        print("(バイナリファイルのため内容を表示できません)")
-        
-        # 画像ファイルの場合はbase64で出力
-        if file_path.endswith(('.png', '.jpg', '.jpeg', '.gif')):
-            import base64
-            with open(file_path, 'rb') as f:
-                content = f.read()
-                encoded = base64.b64encode(content).decode('utf-8')
-                print(f"Base64エンコード済み画像データ ({{len(encoded)}} 文字):")
-                print(encoded[:100] + "..." if len(encoded) > 100 else encoded)
-"""
-        
-        response = code_client.invoke("executeCode", {
-            "language": "python",
-            "code": read_code
-        })
-        
-        # 実行結果を取得
-        for event in response["stream"]:
-            if "result" in event:
-                result_data = event["result"]
-                if "structuredContent" in result_data:
-                    stdout = result_data["structuredContent"].get("stdout", "")
-                    if stdout:
-                        return stdout.strip()
-        
-        return f"❌ ファイル '{file_path}' の読み取りに失敗しました。"
+        header = (f"📄 ファイル '{file_path}' ({result['size']} bytes, "
+                  f"SHA-256: {result['sha256'][:16]}…) を {result['local_path']} に保存しました")
+        if result["cached"]:
+            header += "（キャッシュ済み）"
+        return f"{header}\n{'-' * 50}\n{_preview_downloaded_file(result['local_path'], result['size'])}"
         
     except Exception as e:
         return f"ファイルダウンロードエラー: {str(e)}"
 
 
+def _with_async_variant(sync_tool):
+    """同期ツールに、専用スレッドプールで実行する非同期版を付ける
+    
+    イベントループをブロックせず、セッションキーなどのコンテキスト変数も引き継ぐ。
+    """
+    async def _arun(**kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            _ASYNC_TOOL_EXECUTOR,
+            functools.partial(context.run, sync_tool.func, **kwargs)
+        )
+    
+    sync_tool.coroutine = _arun
+    return sync_tool
+
+
+for _code_interpreter_tool in (execute_python_code, list_code_interpreter_files,
+                               save_file_to_code_interpreter, download_code_interpreter_file):
+    _with_async_variant(_code_interpreter_tool)
+
+
 def get_available_tools():
     """利用可能なツール一覧を取得"""
     return [
         get_weather_info,
         calculate_math_expression,
+        calculate_math_table,
         create_todo_item,
+        create_todo_items,
+        list_todo_items,
+        update_todo_item,
+        complete_todo_item,
+        delete_todo_item,
         execute_python_code,
+        read_tool_output,
         list_code_interpreter_files,
         save_file_to_code_interpreter,
         download_code_interpreter_file